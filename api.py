@@ -1,25 +1,42 @@
+import asyncio
 import json
-from fastapi import FastAPI, HTTPException
+import uuid
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-from apiUtils import load_schema, save_schema, transform_schema_to_openai_format
+from typing import List, Dict, Optional, Union
+from apiUtils import load_openai_schema
 from buildingBlocks.flowGraph import FlowGraph
-from conversationManger import ConversationManager
+from buildingBlocks.tracing import tracer
+from llm.clients import llm_clients
+from sessionStore import SessionStore
+from jobQueue import QueueFullError
+from conversationHistory import HistoryWindow, agent_summarizer
+from factories.expressions import compile_expression
+from factories.workflowOptimizer import optimize_flow_graph
+from workflowRegistry import CompiledWorkflow, WorkflowRegistry, workflow_hash
 from factories.agentsFactory import AgentsFactory
 from factories.taskFunctionFactory import TaskFunctionFactory
 from factories.tasksFactory import TaskFactory
-from config.settings import import_client, interact_with_agent
+from config.settings import import_client, import_async_client, interact_with_agent, ainteract_with_agent, interact_with_tools, ainteract_with_tools, make_llm_cache, make_tool_executor, configure_tracing, make_memory_store, make_llm_batcher, make_checkpoint_store, make_job_queue
 
 # Initialize FastAPI app
 app = FastAPI()
 
 # Initialize global instances
 llm_client = import_client()
-agentsFactory = AgentsFactory(llm_client=llm_client)
+async_llm_client = import_async_client()
 taskFunctionFactory = TaskFunctionFactory()
 taskFactory = TaskFactory()
-flowGraph = FlowGraph()
-conversation_manager = None
+workflow_registry = WorkflowRegistry(max_workflows=64)
+latest_workflow_id = None  # used by /run when no workflow_id is given
+session_store = SessionStore(memory_store=make_memory_store())  # sessions are keyed by (workflow_id, session_id)
+llm_cache = make_llm_cache()  # None unless LLM_CACHE is set
+llm_batcher = make_llm_batcher()  # None unless LLM_BATCH is set
+checkpoint_store = make_checkpoint_store()  # None unless CHECKPOINT_STORE is set
+tool_executor = make_tool_executor()  # None unless TOOL_EXECUTOR is set
+job_queue = make_job_queue()  # background runs (/run with background=true)
+trace_buffer, metrics_exporter = configure_tracing()
 
 
 # Pydantic Models
@@ -35,6 +52,10 @@ class Tool(BaseModel):
     description: str
     parameters: List[ToolParameter]
     function: str
+    timeout: Optional[float] = None  # seconds, used when tools run in worker processes
+    pure: Optional[bool] = None  # deterministic without side effects - results are memoized by arguments
+    cacheSize: Optional[int] = None  # max memoized results of a pure tool (default 1024)
+    cacheTtl: Optional[float] = None  # seconds a memoized result is valid (default - forever)
 
 
 class Step(BaseModel):
@@ -44,24 +65,34 @@ class Step(BaseModel):
     tool: Optional[str] = None
     input_data_func: Optional[str] = None
     memory_arg: Optional[str] = None
+    cache: Optional[bool] = None  # false - bypass the llm response cache
+    useTools: Optional[bool] = None  # function calling with the agent's tools (llm_interact)
+    maxToolIterations: Optional[int] = None  # max model turns with tool calls (default 5)
+    stablePrefix: Optional[bool] = None  # static prompt text first, variables last (provider prompt cache)
+    id: Optional[str] = None  # referenced by dependsOn of later steps
+    dependsOn: Optional[List[str]] = None  # steps with no dependency between them run in parallel
 
 
 class NodeData(BaseModel):
-    isStartNode: bool
-    taskName: str
-    agent: str
-    steps: List[Step]
+    isStartNode: bool = False
+    taskName: Optional[str] = None
+    agent: Optional[str] = None  # condition nodes: the classifier agent (optional)
+    steps: List[Step] = []  # condition nodes: the classifier steps
+    condition: Optional[str] = None  # condition nodes: safe expression over result / memory
+    maxIterations: Optional[int] = None  # condition nodes: max times the condition routes in a run
+    memoize: Optional[bool] = None  # idempotent task - reuse its result for the same input (with checkpoints)
 
 
 class Node(BaseModel):
     id: str
-    type: str
+    type: str  # "condition" / "end", any other type is a task node
     data: NodeData
 
 
 class Edge(BaseModel):
     source: str
     target: str
+    condition: Optional[Union[bool, int, float, str]] = None  # edges of condition nodes, no condition - default edge
 
 
 class Agent(BaseModel):
@@ -71,16 +102,56 @@ class Agent(BaseModel):
     tools: List[str]
 
 
+class HistoryConfig(BaseModel):
+    maxTokens: int  # token budget of the conversation history
+    summaryAgent: Optional[str] = None  # agent that rolls older turns into memory['conversation_summary']
+    summaryModel: Optional[str] = None
+
+
 class WorkflowSchema(BaseModel):
     agents: List[Agent]
     tools: List[Tool]
     nodes: List[Node]
     edges: List[Edge]
+    history: Optional[HistoryConfig] = None
 
 
-@app.post("/build")
-def initialize_workflow(workflow: WorkflowSchema):
-    global conversation_manager
+def create_task(agentsFactory, node):
+    agent_instance = agentsFactory.getAgent(node.data.agent)
+    steps = [step.model_dump() for step in node.data.steps]
+    try:
+        task_function = taskFunctionFactory.createTaskFunction(steps)
+    except (ValueError, SyntaxError) as e:
+        # invalid or not allowed expression in a tool input / prompt placeholder
+        raise HTTPException(status_code=400, detail=f"Error in the steps of node {node.id}: {str(e)}")
+    return taskFactory.createTask(agent_instance, task_function)
+
+
+def add_condition_node(flowGraph, agentsFactory, node):
+    '''
+    a condition is a safe expression (names: result, memory)
+    or a classifier - an agent with steps whose answer is matched against the edge conditions
+    '''
+    if node.data.condition:
+        try:
+            expression = compile_expression(node.data.condition)
+        except (ValueError, SyntaxError) as e:
+            raise HTTPException(status_code=400, detail=f"Error in the condition of node {node.id}: {str(e)}")
+        condition_func = lambda result, memory: expression({"result": result, "memory": memory})
+        flowGraph.add_condition(node.id, condition_func, max_iterations=node.data.maxIterations)
+    elif node.data.agent and node.data.steps:
+        flowGraph.add_condition(node.id, task=create_task(agentsFactory, node), max_iterations=node.data.maxIterations)
+    else:
+        raise HTTPException(status_code=400, detail=f"Condition node {node.id} needs a condition or an agent with steps.")
+
+
+def compile_workflow(workflow: WorkflowSchema, workflow_id):
+    '''
+    build the tools, agents, task plans and flow graph of a workflow
+    every workflow gets its own factories, so workflows don't share tools or agents
+    '''
+    agentsFactory = AgentsFactory(llm_client=llm_client, async_llm_client=async_llm_client, tool_executor=tool_executor)
+    flowGraph = FlowGraph()
 
     # Step 1: Add Tools
     for tool in workflow.tools:
@@ -88,70 +159,344 @@ def initialize_workflow(workflow: WorkflowSchema):
             agentsFactory.toolsFactory.addTool(
                 tool.name,
                 tool.function,
-                {"description": tool.description, **{param.name: param.type for param in tool.parameters}}
+                {"description": tool.description, **{
+                    param.name: {"type": param.type, "description": param.description, "required": param.required}
+                    for param in tool.parameters
+                }},
+                timeout=tool.timeout,
+                pure=bool(tool.pure),
+                cache_size=tool.cacheSize or 1024,
+                cache_ttl=tool.cacheTtl
             )
-        except ValueError as e:
+        except (ValueError, SyntaxError) as e:
             raise HTTPException(status_code=400, detail=f"Error adding tool {tool.name}: {str(e)}")
+    if tool_executor and workflow.tools:
+        # start the workers with the new tools before the first run
+        tool_executor.warm_up()
 
     # Step 2: Create Agents
+    interact_func, ainteract_func = interact_with_agent, ainteract_with_agent
+    # function calling turns are not cached - the tool results they lead to may change
+    tools_interact_func, atools_interact_func = interact_with_tools, ainteract_with_tools
+    if llm_batcher:
+        interact_func, ainteract_func = llm_batcher.wrap(interact_func), llm_batcher.awrap(ainteract_func)
+        tools_interact_func, atools_interact_func = llm_batcher.wrap(tools_interact_func), llm_batcher.awrap(atools_interact_func)
+    # the cache goes outside the batcher, so cache hits are not queued
+    if llm_cache:
+        interact_func, ainteract_func = llm_cache.wrap(interact_func), llm_cache.awrap(ainteract_func)
     for agent in workflow.agents:
         agentsFactory.createAgent(
             name=agent.name,
-            interact_func=interact_with_agent,  # Replace with actual interaction function
+            interact_func=interact_func,  # Replace with actual interaction function
             role=agent.role,
-            tools=agent.tools
+            tools=agent.tools,
+            ainteract_func=ainteract_func,
+            tools_interact_func=tools_interact_func,
+            atools_interact_func=atools_interact_func
         )
 
     # Step 3: Create Nodes and Tasks
     start_node_id = None
     for node in workflow.nodes:
-        agent_instance = agentsFactory.getAgent(node.data.agent)
-        steps = [step.model_dump() for step in node.data.steps]
-        task_function = taskFunctionFactory.createTaskFunction(steps)
-        task = taskFactory.createTask(agent_instance, task_function)
-        flowGraph.add_task(node.id, task)
+        if node.type == "end":
+            flowGraph.add_end(node.id)
+        elif node.type == "condition":
+            add_condition_node(flowGraph, agentsFactory, node)
+        else:
+            flowGraph.add_task(node.id, create_task(agentsFactory, node), memoize=bool(node.data.memoize))
         if node.data.isStartNode:
             start_node_id = node.id
 
     # Step 4: Add Edges
     for edge in workflow.edges:
-        flowGraph.add_edge(edge.source, edge.target)
+        flowGraph.add_edge(edge.source, edge.target, edge.condition)
 
     # Step 5: Set Start Node
     if start_node_id:
         flowGraph.set_start_node(start_node_id)
     else:
         raise HTTPException(status_code=400, detail="No start node specified in workflow.")
+    try:
+        # validate and compile the transition table now, not on the first run
+        flowGraph.compile()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid workflow graph: {str(e)}")
+    # fold constant tool inputs / pure tool calls, drop unused steps, fuse task chains
+    optimization = optimize_flow_graph(flowGraph)
+
+    # Step 6: Conversation history window
+    history_window = None
+    if workflow.history:
+        summarizer = None
+        if workflow.history.summaryAgent:
+            summarizer = agent_summarizer(
+                agentsFactory.getAgent(workflow.history.summaryAgent),
+                model=workflow.history.summaryModel or "gpt-4o-mini"
+            )
+        history_window = HistoryWindow(max_tokens=workflow.history.maxTokens, summarizer=summarizer)
 
-    # Step 6: Initialize Conversation Manager
-    conversation_manager = ConversationManager(flowGraph, id="1")
+    return CompiledWorkflow(workflow_id, agentsFactory, flowGraph, history_window, optimization)
 
-    return {"status": "Workflow initialized successfully"}
+
+@app.post("/build")
+def initialize_workflow(workflow: WorkflowSchema):
+    '''
+    compile the workflow (or reuse the cached one for the same design)
+    and return its id for /run
+    '''
+    global latest_workflow_id
+
+    workflow_id = workflow_hash(workflow.model_dump())
+    compiled_workflow, built = workflow_registry.get_or_build(workflow_id, lambda: compile_workflow(workflow, workflow_id))
+    latest_workflow_id = workflow_id
+
+    return {"status": "Workflow initialized successfully", "workflow_id": workflow_id, "cached": not built,
+            "optimization": compiled_workflow.optimization}
+
+
+def get_workflow(workflow_id):
+    workflow_id = workflow_id or latest_workflow_id
+    if workflow_id is None:
+        raise HTTPException(status_code=400, detail="Workflow not initialized.")
+    compiled_workflow = workflow_registry.get(workflow_id)
+    if compiled_workflow is None:
+        raise HTTPException(status_code=404, detail=f"Workflow {workflow_id} not found, build it again.")
+    return compiled_workflow
 
 
 class UserInput(BaseModel):
     user_input: str
+    session_id: Optional[str] = None  # a new session is created if not given
+    workflow_id: Optional[str] = None  # the id returned by /build, default is the last built workflow
+    stream: bool = False  # stream the run as Server-Sent Events
+    background: bool = False  # queue the run as a job, poll /jobs/{job_id} for the result
+    priority: int = 0  # background jobs with a higher priority run first
 
-@app.post("/run")
-def run_workflow(user_input: UserInput):
-    global conversation_manager
 
-    if not conversation_manager:
-        raise HTTPException(status_code=400, detail="Workflow not initialized.")
+def format_sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def create_checkpoint(run_id, compiled_workflow, session_id, user_input, conversation_manager):
+    '''
+    the checkpoint of a new run (None when checkpoints are off)
+    '''
+    if run_id is None:
+        return None
+    return await asyncio.to_thread(
+        checkpoint_store.create_run, run_id, compiled_workflow.workflow_id, session_id, user_input, conversation_manager.memory)
+
+
+async def finish_run(run_id, error=None):
+    if run_id is not None:
+        await asyncio.to_thread(checkpoint_store.finish, run_id, "failed" if error else "completed", error)
 
+
+def run_error(e, run_id):
+    # with checkpoints the client gets the run id to resume the run
+    return HTTPException(status_code=500, detail={"error": str(e), "run_id": run_id} if run_id else str(e))
+
+
+async def stream_run(compiled_workflow, session_id, user_input):
+    '''
+    yields the events of a run (see ConversationManager.astream)
+    errors are sent as an error event - the response has already started
+    '''
+    session_key = (compiled_workflow.workflow_id, session_id)
+    run_id = uuid.uuid4().hex if checkpoint_store else None
+    async with session_store.session(session_key, compiled_workflow.flow_graph, compiled_workflow.history_window) as conversation_manager:
+        try:
+            checkpoint = await create_checkpoint(run_id, compiled_workflow, session_id, user_input, conversation_manager)
+            async for event in conversation_manager.astream(user_input, checkpoint=checkpoint):
+                if event["event"] == "end":
+                    await finish_run(run_id)
+                    event = {**event, "session_id": session_id, "workflow_id": compiled_workflow.workflow_id, "run_id": run_id}
+                yield event
+        except Exception as e:
+            await finish_run(run_id, str(e))
+            yield {"event": "error", "detail": str(e), "session_id": session_id, "run_id": run_id}
+
+
+async def execute_run(compiled_workflow, session_id, user_input):
+    run_id = uuid.uuid4().hex if checkpoint_store else None
+    try:
+        session_key = (compiled_workflow.workflow_id, session_id)
+        async with session_store.session(session_key, compiled_workflow.flow_graph, compiled_workflow.history_window) as conversation_manager:
+            checkpoint = await create_checkpoint(run_id, compiled_workflow, session_id, user_input, conversation_manager)
+            response, run_time = await conversation_manager.arun(user_input, checkpoint=checkpoint)
+        await finish_run(run_id)
+        return {"response": response, "run_time": run_time, "session_id": session_id,
+                "workflow_id": compiled_workflow.workflow_id, "run_id": run_id}
+    except asyncio.CancelledError:
+        # a cancelled job - the run keeps its checkpoints and can be resumed
+        await finish_run(run_id, "cancelled")
+        raise
+    except Exception as e:
+        await finish_run(run_id, str(e))
+        raise run_error(e, run_id)
+
+
+def submit_job(compiled_workflow, session_id, user_input, tenant):
     try:
-        response, run_time = conversation_manager.run(user_input.user_input)
-        return {"response": response, "run_time": run_time}
+        job = job_queue.submit(lambda: execute_run(compiled_workflow, session_id, user_input.user_input),
+                               tenant=tenant, priority=user_input.priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    return {"job_id": job.job_id, "status": job.status, "session_id": session_id,
+            "workflow_id": compiled_workflow.workflow_id}
+
+
+@app.post("/run")
+async def run_workflow(user_input: UserInput, x_tenant_id: Optional[str] = Header(None)):
+    compiled_workflow = get_workflow(user_input.workflow_id)
+
+    session_id = user_input.session_id or uuid.uuid4().hex
+    if user_input.stream:
+        async def event_stream():
+            async for event in stream_run(compiled_workflow, session_id, user_input.user_input):
+                yield format_sse(event)
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+    if user_input.background:
+        return submit_job(compiled_workflow, session_id, user_input, x_tenant_id or "default")
+    return await execute_run(compiled_workflow, session_id, user_input.user_input)
+
+
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
+
+
+@app.get("/jobs/stats")
+def job_stats():
+    return job_queue.stats()
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    '''
+    the /run response of a completed job, 409 while the job is queued or running
+    '''
+    job = get_job(job_id)
+    if job.status == "completed":
+        return job.result
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=410, detail=f"Job {job_id} was cancelled.")
+    raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}.")
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    get_job(job_id)
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already finished.")
+    return {"status": "Job cancelled"}
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    await job_queue.stop()
+
+
+def get_run(run_id):
+    if not checkpoint_store:
+        raise HTTPException(status_code=400, detail="Checkpoints are not enabled.")
+    run = checkpoint_store.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Run {run_id} not found.")
+    return run
+
+
+@app.get("/runs/{run_id}")
+def run_status(run_id: str):
+    return get_run(run_id)
+
+
+@app.post("/runs/{run_id}/resume")
+async def resume_run(run_id: str):
+    '''
+    continue a failed (or interrupted) run from its last checkpoint,
+    the nodes that finished before the failure are not executed again
+    '''
+    run = get_run(run_id)
+    if run["status"] == "completed":
+        raise HTTPException(status_code=409, detail=f"Run {run_id} already completed.")
+    compiled_workflow = get_workflow(run["workflow_id"])
+    checkpoint = await asyncio.to_thread(checkpoint_store.checkpoint, run_id)
+    try:
+        session_key = (compiled_workflow.workflow_id, run["session_id"])
+        async with session_store.session(session_key, compiled_workflow.flow_graph, compiled_workflow.history_window) as conversation_manager:
+            response, run_time = await conversation_manager.aresume(checkpoint, run["user_input"])
+        await finish_run(run_id)
+        return {"response": response, "run_time": run_time, "session_id": run["session_id"],
+                "workflow_id": compiled_workflow.workflow_id, "run_id": run_id}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        await finish_run(run_id, str(e))
+        raise run_error(e, run_id)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    '''
+    prometheus text format - duration summaries per workflow / node / step / llm / tool
+    '''
+    return metrics_exporter.render()
 
 
+@app.get("/traces")
+def traces(limit: int = 100):
+    return {"spans": [span.to_dict() for span in trace_buffer.spans(limit)]}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    if not llm_cache:
+        return {"enabled": False}
+    return {"enabled": True, **llm_cache.stats()}
+
+
+@app.get("/tools/stats")
+def tool_stats(workflow_id: Optional[str] = None):
+    '''
+    hit rates of the memoized (pure) tools of a workflow
+    '''
+    return get_workflow(workflow_id).agents_factory.toolsFactory.cacheStats()
+
+
+@app.get("/llm/stats")
+def llm_stats():
+    '''
+    connection pool settings, the rate limit state per model
+    and the prompt cache hit ratio per node
+    '''
+    stats = llm_clients.stats()
+    stats["prompt_cache"] = {str(node): value for node, value in metrics_exporter.prompt_cache_stats().items()}
+    return stats
+
+
+@app.get("/batcher/stats")
+def batcher_stats():
+    if not llm_batcher:
+        return {"enabled": False}
+    return {"enabled": True, "models": llm_batcher.stats()}
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, workflow_id: Optional[str] = None):
+    if not await session_store.delete((workflow_id or latest_workflow_id, session_id)):
+        raise HTTPException(status_code=404, detail="Session not found.")
+    return {"status": "Session deleted"}
+
 
 
-# Load and transform the schema
-original_schema = load_schema("schema.json")
-openai_response_schema = transform_schema_to_openai_format(original_schema)
-save_schema("transformed_schema.json", openai_response_schema)  # debug
 
 class GenerateRequest(BaseModel):
     """Request model for the generate endpoint."""
@@ -177,17 +522,16 @@ def generate_workflow(request: GenerateRequest):
         )
 
         # Call the OpenAI API with structured outputs
-        response = llm_client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant for creating structured JSON Agentic workflows."},
-                {"role": "user", "content": llm_prompt}
-            ],
-            response_format=openai_response_schema
-        )
-
-        # Extract the structured JSON output
-        generated_json = response.choices[0].message.content
+        with tracer.span("llm", "gpt-4o-mini", endpoint="generate"):
+            generated_json = interact_with_agent(
+                llm_client=llm_client,
+                model="gpt-4o-mini", 
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant for creating structured JSON Agentic workflows."},
+                    {"role": "user", "content": llm_prompt}
+                ],
+                response_format=load_openai_schema("schema.json")  # transformed once, cached by content hash
+            )
 
         # Convert JSON string to a Python dictionary
         workflow = json.loads(generated_json)
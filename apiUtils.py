@@ -1,3 +1,4 @@
+import hashlib
 import json
 
 # Utility functions for schema transformation
@@ -60,4 +61,25 @@ def transform_schema_to_openai_format(schema: dict, name="workflow") -> dict:
             "schema": schema,
             "strict": True,
         },
-    }
\ No newline at end of file
+    }
+
+
+_openai_schemas = {}  # sha256 of the schema file -> transformed schema
+
+
+def load_openai_schema(file_path: str, name="workflow") -> dict:
+    """
+    Load a JSON schema file in OpenAI's response_format structure.
+    The transformation is cached by the hash of the file content, so it runs once per schema version.
+    """
+    with open(file_path, "rb") as schema_file:
+        content = schema_file.read()
+    key = (hashlib.sha256(content).hexdigest(), name)
+    if key not in _openai_schemas:
+        _openai_schemas[key] = transform_schema_to_openai_format(json.loads(content), name=name)
+    return _openai_schemas[key]
+
+
+if __name__ == "__main__":
+    # regenerate transformed_schema.json (for inspection) after editing schema.json
+    save_schema("transformed_schema.json", load_openai_schema("schema.json"))
@@ -0,0 +1,177 @@
+'''
+local OpenAI-compatible stub server for the benchmarks
+
+serves POST /v1/chat/completions (plain and streamed), with:
+- latency: seconds before the first token
+- tokens_per_second: generation speed of the completion_tokens tokens
+- error_rate: share of requests answered with error_status (429 comes with a retry-after header)
+- prefix_cache: simulate the provider's prompt cache - prompts are hashed in blocks of prefix_cache_block tokens
+  (from prefix_cache_min tokens on), the blocks of a prefix seen before are reported as
+  usage.prompt_tokens_details.cached_tokens
+
+usage:
+    server = MockLLMServer(latency=0.05, tokens_per_second=200, error_rate=0.01)
+    base_url = server.start()  # e.g. http://127.0.0.1:53211/v1 - set as OPENAI_BASE_URL
+    ...
+    server.stop()
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+import uuid
+
+
+class MockLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, tokens_per_second=200.0, completion_tokens=20,
+                 error_rate=0.0, error_status=429, retry_after=0.05, seed=None, prefix_cache=False,
+                 prefix_cache_min=1024, prefix_cache_block=128):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.prefix_cache = prefix_cache
+        self.prefix_cache_min = prefix_cache_min
+        self.prefix_cache_block = prefix_cache_block
+        self.prefixes = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors}
+
+    def _should_fail(self):
+        with self.lock:
+            self.requests += 1
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return fail
+
+    def _cached_tokens(self, prompt):
+        '''
+        tokens (4 characters each) of the longest block-aligned prefix of the prompt seen before
+        '''
+        if not self.prefix_cache or len(prompt) // 4 < self.prefix_cache_min:
+            return 0
+        block = self.prefix_cache_block * 4
+        cached = 0
+        with self.lock:
+            for end in range(block, len(prompt) + 1, block):
+                key = hash(prompt[:end])
+                if key in self.prefixes:
+                    if cached == end - block:
+                        cached = end
+                else:
+                    self.prefixes.add(key)
+        return cached // 4 if cached // 4 >= self.prefix_cache_min else 0
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                if mock._should_fail():
+                    headers = {"retry-after": str(mock.retry_after)} if mock.error_status == 429 else {}
+                    self._send_json(mock.error_status, {"error": {"message": "injected error", "type": "mock"}}, headers)
+                    return
+                model = request.get("model", "mock")
+                prompt = "".join(f"{message.get('role')}:{message.get('content') or ''}\n" for message in request.get("messages", []))
+                prompt_tokens = len(prompt) // 4
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": mock.completion_tokens,
+                    "total_tokens": prompt_tokens + mock.completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": mock._cached_tokens(prompt)},
+                }
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                created = int(time.time())
+                token_time = 1.0 / mock.tokens_per_second if mock.tokens_per_second else 0.0
+                time.sleep(mock.latency)
+
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for index in range(mock.completion_tokens):
+                        time.sleep(token_time)
+                        self._send_event({
+                            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                            "choices": [{"index": 0, "delta": {"content": f"tok{index} "}, "finish_reason": None}],
+                        })
+                    self._send_event({
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    })
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        self._send_event({
+                            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                            "choices": [], "usage": usage,
+                        })
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+
+                time.sleep(token_time * mock.completion_tokens)
+                self._send_json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(f"tok{index}" for index in range(mock.completion_tokens))},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+
+            def _send_event(self, event):
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,312 @@
+'''
+benchmark harness - measures the framework's own overhead against a local mock llm server
+
+for every scenario (see benchmarks/scenarios.py) and mode (in-process / http):
+- latency: requests one at a time - p50/p99 latency, llm time (wall time with an llm call in flight,
+  from the llm spans) and framework overhead (latency - llm time)
+- throughput: requests with `concurrency` in flight - requests per second
+- allocations (in-process): tracemalloc peak and net bytes per request
+
+results are saved as json, --compare prints the change against an earlier result
+and exits with 1 if the p50 overhead of any scenario regressed by more than --threshold.
+
+usage (from the repository root, so api.py finds schema.json):
+    python -m benchmarks.runBenchmarks --requests 50 --concurrency 8 --latency 0.02 --output bench.json
+    python -m benchmarks.runBenchmarks --compare bench.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+
+from benchmarks.mockServer import MockLLMServer
+from benchmarks.scenarios import all_scenarios
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 0.5),
+        "p99": percentile(values, 0.99),
+    }
+
+
+def busy_time(intervals):
+    '''
+    wall time covered by the (start, end) intervals - parallel llm calls are counted once
+    '''
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+class LLMSpanCollector:
+    '''
+    tracing exporter that keeps the intervals of the llm spans
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervals = []
+
+    def export(self, span):
+        if span.kind == "llm":
+            with self.lock:
+                self.intervals.append((span.start, span.end))
+
+    def drain(self):
+        with self.lock:
+            intervals, self.intervals = self.intervals, []
+        return intervals
+
+
+class InProcessDriver:
+    '''
+    calls the api endpoint functions directly
+    '''
+    def __init__(self, api):
+        self.api = api
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def build(self, workflow):
+        return self.api.initialize_workflow(self.api.WorkflowSchema(**workflow))["workflow_id"]
+
+    async def run(self, workflow_id, session_id, user_input):
+        return await self.api.run_workflow(self.api.UserInput(user_input=user_input, session_id=session_id, workflow_id=workflow_id))
+
+
+class HttpDriver:
+    '''
+    serves the api with uvicorn on a local port and calls it over http
+    the server runs on the benchmark's event loop - the pooled async llm client (llm/clients.py)
+    and the compiled workflows' agents stay bound to the loop they were created on
+    '''
+    def __init__(self, api):
+        self.api = api
+        self.server = None
+        self.task = None
+        self.client = None
+
+    async def start(self):
+        import httpx
+        import uvicorn
+        config = uvicorn.Config(self.api.app, host="127.0.0.1", port=0, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.task = asyncio.ensure_future(self.server.serve())
+        while not self.server.started:
+            if self.task.done():
+                self.task.result()  # raises the startup error
+                raise RuntimeError("uvicorn exited before it started")
+            await asyncio.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300)
+
+    async def stop(self):
+        await self.client.aclose()
+        self.server.should_exit = True
+        await self.task
+
+    async def build(self, workflow):
+        response = await self.client.post("/build", json=workflow)
+        response.raise_for_status()
+        return response.json()["workflow_id"]
+
+    async def run(self, workflow_id, session_id, user_input):
+        response = await self.client.post("/run", json={"user_input": user_input, "session_id": session_id, "workflow_id": workflow_id})
+        response.raise_for_status()
+        return response.json()
+
+
+async def run_scenario(driver, scenario, collector, requests, concurrency, measure_allocations):
+    workflow_id = await driver.build(scenario["workflow"])
+    shared_session = uuid.uuid4().hex if scenario.get("shared_session") else None
+    session_id = lambda: shared_session or uuid.uuid4().hex
+
+    for turn in range(scenario.get("warmup_turns", 0)):
+        await driver.run(workflow_id, shared_session, f"warmup turn {turn}")
+    # one unmeasured run (connections, lazy imports)
+    await driver.run(workflow_id, session_id(), "warmup")
+    collector.drain()
+
+    latencies, llm_times, overheads = [], [], []
+    for index in range(requests):
+        start = time.perf_counter()
+        await driver.run(workflow_id, session_id(), f"request {index}")
+        latency = time.perf_counter() - start
+        llm_time = busy_time(collector.drain())
+        latencies.append(latency)
+        llm_times.append(llm_time)
+        overheads.append(latency - llm_time)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index):
+        async with semaphore:
+            await driver.run(workflow_id, session_id(), f"concurrent request {index}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(index) for index in range(requests)])
+    wall_time = time.perf_counter() - start
+    collector.drain()
+
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "latency": summarize(latencies),
+        "llm_time": summarize(llm_times),
+        "overhead": summarize(overheads),
+        "throughput_rps": requests / wall_time if wall_time else 0.0,
+    }
+
+    if measure_allocations:
+        peaks, net = [], []
+        tracemalloc.start()
+        try:
+            for index in range(min(requests, 20)):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                await driver.run(workflow_id, session_id(), f"allocation request {index}")
+                after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                net.append(after - before)
+        finally:
+            tracemalloc.stop()
+        collector.drain()
+        result["allocations"] = {"peak_bytes": summarize(peaks), "net_bytes": summarize(net)}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    '''
+    prints the change of p50 overhead / p99 latency / throughput, returns the regressed scenarios
+    '''
+    regressions = []
+    for name, modes in results["scenarios"].items():
+        for mode, current in modes.items():
+            previous = baseline.get("scenarios", {}).get(name, {}).get(mode)
+            if previous is None:
+                continue
+            changes = []
+            for label, path in (("overhead p50", ("overhead", "p50")), ("latency p99", ("latency", "p99"))):
+                old, new = previous[path[0]][path[1]], current[path[0]][path[1]]
+                change = (new - old) / old if old else 0.0
+                changes.append(f"{label} {old * 1000:.2f}ms -> {new * 1000:.2f}ms ({change:+.1%})")
+                if label == "overhead p50" and change > threshold:
+                    regressions.append(f"{name}/{mode}")
+            old, new = previous["throughput_rps"], current["throughput_rps"]
+            changes.append(f"throughput {old:.1f} -> {new:.1f} rps")
+            print(f"{name} [{mode}]: " + ", ".join(changes))
+    return regressions
+
+
+async def main(args):
+    server = MockLLMServer(
+        latency=args.latency, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, error_rate=args.error_rate, seed=0
+    )
+    os.environ["OPENAI_BASE_URL"] = server.start()
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("AGENT_VERBOSE", "0")
+
+    import api
+    from buildingBlocks.tracing import tracer
+    collector = tracer.add_exporter(LLMSpanCollector())
+
+    scenarios = all_scenarios()
+    if args.scenarios != "all":
+        names = args.scenarios.split(",")
+        scenarios = [scenario for scenario in scenarios if any(scenario["name"].startswith(name) for name in names)]
+
+    drivers = {"in-process": InProcessDriver, "http": HttpDriver}
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "mock": {
+                "latency": args.latency, "tokens_per_second": args.tokens_per_second,
+                "completion_tokens": args.completion_tokens, "error_rate": args.error_rate,
+            },
+        },
+        "scenarios": {},
+    }
+    try:
+        for mode in args.modes.split(","):
+            driver = drivers[mode](api)
+            await driver.start()
+            try:
+                for scenario in scenarios:
+                    result = await run_scenario(driver, scenario, collector, args.requests, args.concurrency, mode == "in-process")
+                    results["scenarios"].setdefault(scenario["name"], {})[mode] = result
+                    print(f"{scenario['name']} [{mode}]: p50 {result['latency']['p50'] * 1000:.1f}ms, "
+                          f"overhead p50 {result['overhead']['p50'] * 1000:.2f}ms, {result['throughput_rps']:.1f} rps")
+            finally:
+                await driver.stop()
+    finally:
+        server.stop()
+    results["meta"]["mock"].update(server.stats())
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark the framework against a local mock llm server")
+    parser.add_argument("--scenarios", default="all", help="comma separated scenario name prefixes")
+    parser.add_argument("--modes", default="in-process,http")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="mock seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=1000.0)
+    parser.add_argument("--completion-tokens", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 overhead regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"overhead regressions: {', '.join(regressions)}")
+            raise SystemExit(1)
@@ -0,0 +1,106 @@
+'''
+benchmark scenarios - workflow json for /build and how /run is driven
+
+a scenario is a dict:
+- name: str
+- workflow: dict - the /build body
+- shared_session: bool - all requests of the scenario use one session (the history grows)
+- warmup_turns: int - turns run on the shared session before measuring
+'''
+
+MODEL = "gpt-4o-mini"
+
+ADD_TOOL = '''def add(x, y):
+    return x + y'''
+
+
+def _agent(tools=()):
+    return {"id": 1, "name": "bench", "role": "you are a benchmark agent", "tools": list(tools)}
+
+
+def _node(node_id, steps, start=False):
+    return {
+        "id": node_id,
+        "type": "task",
+        "data": {"isStartNode": start, "taskName": node_id, "agent": "bench", "steps": steps},
+    }
+
+
+def _llm_step(template):
+    return {"type": "llm_interact", "promptTemplate": template, "model": MODEL}
+
+
+def linear_chain(length=5):
+    nodes = [_node(f"n{index}", [_llm_step(f"step {index}: {{task_input}}")], start=index == 0) for index in range(length)]
+    edges = [{"source": f"n{index}", "target": f"n{index + 1}"} for index in range(length - 1)]
+    return {
+        "name": f"linear_chain_{length}",
+        "workflow": {"agents": [_agent()], "tools": [], "nodes": nodes, "edges": edges},
+    }
+
+
+def fan_out(width=8):
+    nodes = [_node("start", [_llm_step("plan: {task_input}")], start=True)]
+    nodes += [_node(f"branch{index}", [_llm_step(f"branch {index}: {{task_input}}")]) for index in range(width)]
+    nodes.append(_node("join", [_llm_step("combine: {task_input}")]))
+    edges = [{"source": "start", "target": f"branch{index}"} for index in range(width)]
+    edges += [{"source": f"branch{index}", "target": "join"} for index in range(width)]
+    return {
+        "name": f"fan_out_{width}",
+        "workflow": {"agents": [_agent()], "tools": [], "nodes": nodes, "edges": edges},
+    }
+
+
+def tool_heavy(tool_steps=20):
+    steps = [{"type": "tool", "tool": "add", "input_data_func": f'{{"x": {index}, "y": 1}}'} for index in range(tool_steps)]
+    steps.append(_llm_step("the tools returned {last_step_result}, answer {memory['user_input']}"))
+    tool = {
+        "name": "add",
+        "description": "adds two numbers",
+        "parameters": [
+            {"name": "x", "type": "number", "description": "first", "required": True},
+            {"name": "y", "type": "number", "description": "second", "required": True},
+        ],
+        "function": ADD_TOOL,
+    }
+    return {
+        "name": f"tool_heavy_{tool_steps}",
+        "workflow": {"agents": [_agent(["add"])], "tools": [tool], "nodes": [_node("tools", steps, start=True)], "edges": []},
+    }
+
+
+def condition_loop(iterations=5):
+    '''
+    task -> condition -> back to the task until the loop is capped, then the end node
+    '''
+    nodes = [
+        _node("work", [_llm_step("iterate on: {task_input}")], start=True),
+        {"id": "check", "type": "condition", "data": {"condition": "'again'", "maxIterations": iterations}},
+        {"id": "end", "type": "end", "data": {}},
+    ]
+    edges = [
+        {"source": "work", "target": "check"},
+        {"source": "check", "target": "work", "condition": "again"},
+        {"source": "check", "target": "end", "condition": "done"},
+    ]
+    return {
+        "name": f"condition_loop_{iterations}",
+        "workflow": {"agents": [_agent()], "tools": [], "nodes": nodes, "edges": edges},
+    }
+
+
+def long_history(warmup_turns=100, max_tokens=4000):
+    steps = [_llm_step("history: {memory['conversation_history']}\nuser: {memory['user_input']}")]
+    return {
+        "name": f"long_history_{warmup_turns}",
+        "workflow": {
+            "agents": [_agent()], "tools": [], "nodes": [_node("chat", steps, start=True)], "edges": [],
+            "history": {"maxTokens": max_tokens},
+        },
+        "shared_session": True,
+        "warmup_turns": warmup_turns,
+    }
+
+
+def all_scenarios():
+    return [linear_chain(), fan_out(), condition_loop(), tool_heavy(), long_history()]
@@ -0,0 +1,82 @@
+'''
+cold start benchmark - the time to import a module in a fresh interpreter
+
+every repeat starts a new python process (`python -X importtime -c "import <module>"`),
+so nothing is cached in sys.modules. reports the median / max wall time
+and the slowest imports (cumulative, from -X importtime) of the last run.
+exits with 1 if the median of any module is over --budget seconds.
+
+usage (from the repository root):
+    python -m benchmarks.startupTime --modules api --repeat 5 --budget 1.5
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def parse_importtime(stderr):
+    '''
+    returns [(cumulative seconds, module)] from -X importtime output
+    '''
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|", 2)
+        imports.append((int(cumulative) / 1e6, module.strip()))
+    return imports
+
+
+def measure(module, repeat, environment):
+    times = []
+    imports = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                 capture_output=True, text=True, env=environment)
+        times.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+        imports = parse_importtime(process.stderr)
+    slowest = sorted(imports, reverse=True)[:10]
+    return {
+        "median": statistics.median(times),
+        "max": max(times),
+        "slowest_imports": [{"module": name, "cumulative": seconds} for seconds, name in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure the cold import time of modules")
+    parser.add_argument("--modules", default="api", help="comma separated modules")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None, help="max median seconds per module")
+    parser.add_argument("--output", help="save the results as json")
+    args = parser.parse_args()
+
+    environment = {**os.environ, "AGENT_VERBOSE": os.environ.get("AGENT_VERBOSE", "0")}
+    environment.setdefault("OPENAI_API_KEY", "startup-benchmark")
+    results = {}
+    over_budget = []
+    for module in args.modules.split(","):
+        result = measure(module, args.repeat, environment)
+        results[module] = result
+        print(f"import {module}: median {result['median'] * 1000:.0f}ms, max {result['max'] * 1000:.0f}ms")
+        for item in result["slowest_imports"][:5]:
+            print(f"    {item['cumulative'] * 1000:8.1f}ms  {item['module']}")
+        if args.budget is not None and result["median"] > args.budget:
+            over_budget.append(module)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if over_budget:
+        print(f"over the {args.budget}s budget: {', '.join(over_budget)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 
 
 
-import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
+import contextvars
+
+from buildingBlocks.tracing import tracer
 
 
 class Agent:
@@ -13,43 +17,201 @@ class Agent:
     role: str - the role of the agent ** system prompt **
     step_handler: StepHandler instance for handling the steps
     tools: dict - dictionary of tools available to the agent
+    async_llm_client: async client instance for the llm (optional)
+    ainteract_func: coroutine function that interacts with the llm (optional)
+                    ** if not set, aexecute runs interact_func in a worker thread **
+    tools_interact_func: function(llm_client, messages, model, tools, **kwargs) -> assistant message dict,
+                         used by llm_interact steps with use_tools (function calling, optional)
+    atools_interact_func: coroutine version of tools_interact_func (optional)
     '''
     
-    def __init__(self, name, llm_client, interact_func, role, step_handler):
+    def __init__(self, name, llm_client, interact_func, role, step_handler, async_llm_client=None, ainteract_func=None,
+                 tools_interact_func=None, atools_interact_func=None):
         self.name = name
         self.llm_client = llm_client
         self.tools = {}
         self.interact_func = interact_func
         self.role = role
         self.step_handler = step_handler
+        self.async_llm_client = async_llm_client
+        self.ainteract_func = ainteract_func
+        self.tools_interact_func = tools_interact_func
+        self.atools_interact_func = atools_interact_func
+        self._tool_schemas = None
 
 
     def add_tool(self, tool_name, tool_info):
         self.tools[tool_name] = tool_info # tool_info: [toolFunction, toolDescription]
+        self._tool_schemas = None
+
+    def tool_schemas(self):
+        '''
+        the agent's tools as OpenAI tool schemas (built once, until a tool is added)
+        '''
+        if self._tool_schemas is None:
+            self._tool_schemas = [tool_schema(tool_name, tool_info[1]) for tool_name, tool_info in self.tools.items()]
+        return self._tool_schemas
     
 
-    def execute(self, steps):
+    def execute(self, steps, task_input=None, memory=None):
         '''
+        task_input, memory: passed to the step handlers (built steps don't capture them)
         function: function that returns the messages list for the llm
         model: str - the model to use for the llm (as the agent can use 
                                 different models for different tasks)
+        steps with depends_on run as a dependency graph (see execute_graph)
         '''
 
         # last_step_response: the response of the last step
         # Task's input is already embedded in the first step
-        
+        if has_dependencies(steps):
+            return self.execute_graph(steps, task_input, memory)
+
         last_step_response = None
-        for step in steps:
-            handler = self.step_handler.get(step["type"])
-            if handler:
-                # start time
-                start_time = time.time()
-                last_step_response = handler(self, step, last_step_response)
-                # end time
-                end_time = time.time()
-                print(f"step {step['type']} executed in {end_time - start_time} seconds.")
-                print(f"step {step['type']} executed successfully.\nResult:\n{last_step_response}\n---------------------------------\n")
+        for index, step in enumerate(steps):
+            last_step_response = self._execute_step(index, step, last_step_response, task_input, memory)
         return last_step_response
-    
-    
 
+    def _execute_step(self, index, step, response, task_input, memory):
+        handler = self.step_handler.get(step["type"])
+        if not handler:
+            return response
+        with tracer.span("step", step["type"], agent=self.name, index=index) as span:
+            response = handler(self, step, response, task_input, memory)
+        if tracer.verbose:
+            if span is not None:
+                print(f"step {step['type']} executed in {span.duration} seconds.")
+            print(f"step {step['type']} executed successfully.\nResult:\n{response}\n---------------------------------\n")
+        return response
+
+    def execute_graph(self, steps, task_input=None, memory=None):
+        '''
+        run every step as soon as the steps it depends on finished - independent steps run in parallel threads.
+        the task's result is the result of the last step
+        '''
+        results = {}
+        remaining = {index: set(step_dependencies(index, step)) for index, step in enumerate(steps)}
+        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            running = {}
+            while remaining or running:
+                for index in [index for index, dependencies in remaining.items() if dependencies.issubset(results)]:
+                    del remaining[index]
+                    step_input = combine_results(steps, step_dependencies(index, steps[index]), results)
+                    context = contextvars.copy_context()
+                    future = executor.submit(context.run, self._execute_step, index, steps[index], step_input, task_input, memory)
+                    running[future] = index
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return results[len(steps) - 1]
+
+    async def aexecute(self, steps, task_input=None, memory=None, emit=None):
+        '''
+        async version of execute - steps are awaited one after the other
+        (steps with depends_on run as a dependency graph, see aexecute_graph)
+        emit: function(event: dict) - if given, llm_interact steps stream their tokens
+              as {"event": "token", "step": index, "content": token} events
+        '''
+        if has_dependencies(steps):
+            return await self.aexecute_graph(steps, task_input, memory, emit)
+
+        last_step_response = None
+        for index, step in enumerate(steps):
+            last_step_response = await self._aexecute_step(index, step, last_step_response, task_input, memory, emit)
+        return last_step_response
+
+    async def _aexecute_step(self, index, step, response, task_input, memory, emit):
+        handler = self.step_handler.aget(step["type"])
+        if not handler:
+            return response
+        on_token = None
+        if emit is not None:
+            on_token = lambda token: emit({"event": "token", "step": index, "content": token})
+        with tracer.span("step", step["type"], agent=self.name, index=index) as span:
+            response = await handler(self, step, response, task_input, memory, on_token=on_token)
+        if tracer.verbose:
+            if span is not None:
+                print(f"step {step['type']} executed in {span.duration} seconds.")
+            print(f"step {step['type']} executed successfully.\nResult:\n{response}\n---------------------------------\n")
+        return response
+
+    async def aexecute_graph(self, steps, task_input=None, memory=None, emit=None):
+        '''
+        async version of execute_graph - every step is a task that awaits the steps it depends on
+        '''
+        tasks = []
+
+        async def run_step(index, step):
+            dependencies = step_dependencies(index, step)
+            results = await asyncio.gather(*[tasks[dependency] for dependency in dependencies])
+            step_input = combine_results(steps, dependencies, dict(zip(dependencies, results)))
+            return await self._aexecute_step(index, step, step_input, task_input, memory, emit)
+
+        for index, step in enumerate(steps):
+            tasks.append(asyncio.ensure_future(run_step(index, step)))
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        return results[-1]
+
+
+JSON_TYPES = {
+    "number": "number", "float": "number", "integer": "integer", "int": "integer",
+    "string": "string", "str": "string", "boolean": "boolean", "bool": "boolean",
+    "array": "array", "list": "array", "object": "object", "dict": "object",
+}
+
+
+def tool_schema(tool_name, description):
+    '''
+    OpenAI function schema of a tool
+    description: {"description": str, parameter name: type} - a type is a string ("number", "string", ...)
+                 or a dict {"type": .., "description": .., "required": bool}, parameters are required by default
+    '''
+    if not isinstance(description, dict):
+        description = {"description": str(description)}
+    properties, required = {}, []
+    for name, parameter in description.items():
+        if name == "description":
+            continue
+        if not isinstance(parameter, dict):
+            parameter = {"type": parameter}
+        properties[name] = {"type": JSON_TYPES.get(str(parameter.get("type")).lower(), "string")}
+        if parameter.get("description"):
+            properties[name]["description"] = parameter["description"]
+        if parameter.get("required", True):
+            required.append(name)
+    return {
+        "type": "function",
+        "function": {
+            "name": tool_name,
+            "description": description.get("description", ""),
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+
+def has_dependencies(steps):
+    return any("depends_on" in step for step in steps)
+
+
+def step_dependencies(index, step):
+    '''
+    indices of the steps this step waits for - without depends_on, the previous step
+    '''
+    return step.get("depends_on", (index - 1,) if index else ())
+
+
+def combine_results(steps, dependencies, results):
+    '''
+    the last_step_result of a step: None without dependencies, the result of a single dependency,
+    or a dict {step id: result} of several dependencies
+    '''
+    if not dependencies:
+        return None
+    if len(dependencies) == 1:
+        return results[dependencies[0]]
+    return {steps[index].get("id", str(index)): results[index] for index in dependencies}
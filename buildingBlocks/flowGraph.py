@@ -1,12 +1,29 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
+import contextvars
+import json
 
 from buildingBlocks.task import Task
+from buildingBlocks.tracing import tracer
+
+
+# node kinds in the compiled transition table
+TASK, CONDITION, END = 0, 1, 2
 
 
 class ConditionNode:
-    def __init__(self, condition_function):
+    '''
+    condition_function: function(result, memory) -> value, matched against the conditions of the outgoing edges
+    task: Task (optional) - a classifier, its result (stripped, case-insensitive) is matched instead
+    max_iterations: int - how many times the condition routes in a single run,
+                    afterwards the branch ends (default for conditions in a cycle: FlowGraph.max_iterations)
+    an edge without a condition is the default route
+    the input of the condition passes through to the chosen node
+    '''
+    def __init__(self, condition_function=None, task=None, max_iterations=None):
         self.condition_function = condition_function
+        self.task = task
+        self.max_iterations = max_iterations
         self.edges = {}
 
 
@@ -15,21 +32,196 @@ class ConditionNode:
 
     def get_next_node(self, result, memory):
         condition_result = self.condition_function(result, memory)
-        return self.edges.get(condition_result, None)
+        return self.edges.get(condition_result, self.edges.get(None))
+
+
+class EndNode:
+    '''
+    explicit end of a branch - its input is a result of the run
+    '''
+
+
+def json_copy(value):
+    '''
+    copy of a json-able value (for checkpoint snapshots), other values become strings
+    '''
+    return json.loads(json.dumps(value, default=str))
+
+
+def normalize_label(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def merge_results(results):
+    '''
+    default merge function for join nodes
+    results: dict - predecessor node id -> result, in the order the edges were added
+    the join node gets the dict as its input (e.g. {task_input['research']} in a template)
+    '''
+    return results
+
+
+class CompiledGraph:
+    '''
+    dense integer-indexed transition table of a flow graph (see FlowGraph.compile)
+    node_ids[i], kinds[i] (TASK / CONDITION / END), nodes[i]
+    successors[i]: tuple of node indices (task nodes)
+    routes[i]: dict condition value -> node index, defaults[i]: node index or -1 (condition nodes)
+    max_iterations[i]: int or None (condition nodes)
+    join_predecessors[i]: tuple of node indices a join waits for (back edges of loops excluded)
+    memoize[i]: bool - the task's result is memoized by its input (see checkpointStore.py)
+    chains[i]: tuple of the task indices fused after task i - a straight line of tasks
+               (single successor, single predecessor) runs as one unit, without going through the scheduler
+    '''
+    __slots__ = ("node_ids", "index", "kinds", "nodes", "successors", "routes", "defaults",
+                 "max_iterations", "join_predecessors", "memoize", "chains", "start")
+
+
+class _RunState:
+    '''
+    book-keeping for a single run of the graph:
+    join nodes that wait for their predecessors, loop iterations and the results of the terminal nodes
+    '''
+    def __init__(self, flow_graph, graph):
+        self.flow_graph = flow_graph
+        self.graph = graph
+        self.waiting = {}  # join node index -> {predecessor index: result}
+        self.final = {}  # terminal node index -> result
+        self.iterations = [0] * len(graph.node_ids)
+
+    def next_nodes(self, index, value):
+        '''
+        value: the condition value (condition nodes)
+        '''
+        graph = self.graph
+        kind = graph.kinds[index]
+        if kind == TASK:
+            return graph.successors[index]
+        if kind == END:
+            return ()
+        self.iterations[index] += 1
+        limit = graph.max_iterations[index]
+        if limit is not None and self.iterations[index] > limit:
+            # loop capped - the branch ends here
+            return ()
+        try:
+            next_node = graph.routes[index].get(value, graph.defaults[index])
+        except TypeError:
+            # unhashable condition value
+            next_node = graph.defaults[index]
+        return () if next_node < 0 else (next_node,)
+
+    def deliver(self, from_node, next_nodes, result):
+        '''
+        pass the result of from_node to its successors
+        returns the list of (node index, input) that are ready to run
+        '''
+        if not next_nodes:
+            self.final.pop(from_node, None)
+            self.final[from_node] = result
+            return []
+
+        ready = []
+        for next_node in next_nodes:
+            predecessors = self.graph.join_predecessors[next_node]
+            if len(predecessors) <= 1 or from_node not in predecessors:
+                ready.append((next_node, result))
+                continue
+            arrived = self.waiting.setdefault(next_node, {})
+            arrived[from_node] = result
+            if len(arrived) == len(predecessors):
+                ready.append((next_node, self.flow_graph._merge(self.graph, next_node, self.waiting.pop(next_node))))
+        return ready
+
+    def flush(self):
+        '''
+        called when nothing is running anymore - release the join nodes that are still waiting
+        (a condition routed around some of their predecessors, so those results will never arrive)
+        '''
+        ready = [(index, self.flow_graph._merge(self.graph, index, arrived)) for index, arrived in self.waiting.items()]
+        self.waiting = {}
+        return ready
+
+    def snapshot(self, pending):
+        '''
+        the routing state as json-able dict (by node id) - pending: list of (node index, input) not finished yet
+        '''
+        node_ids = self.graph.node_ids
+        return {
+            "pending": [[node_ids[index], input] for index, input in pending],
+            "waiting": {node_ids[index]: {node_ids[pred]: result for pred, result in arrived.items()}
+                        for index, arrived in self.waiting.items()},
+            "final": [[node_ids[index], result] for index, result in self.final.items()],
+            "iterations": {node_ids[index]: count for index, count in enumerate(self.iterations) if count},
+        }
+
+    def restore(self, snapshot):
+        '''
+        load a snapshot, returns the pending (node index, input) list
+        '''
+        index = self.graph.index
+        self.waiting = {index[node_id]: {index[pred]: result for pred, result in arrived.items()}
+                        for node_id, arrived in snapshot["waiting"].items()}
+        self.final = {index[node_id]: result for node_id, result in snapshot["final"]}
+        for node_id, count in snapshot["iterations"].items():
+            self.iterations[index[node_id]] = count
+        return [(index[node_id], input) for node_id, input in snapshot["pending"]]
+
+    def result(self, default):
+        if not self.final:
+            return default
+        if len(self.final) == 1:
+            return next(iter(self.final.values()))
+        return merge_results({self.graph.node_ids[index]: result for index, result in self.final.items()})
 
 
 class FlowGraph:
-    def __init__(self):
+    def __init__(self, max_workers=None, max_iterations=100):
+        '''
+        max_workers: int - max number of branches running at the same time in run
+                     (None - ThreadPoolExecutor default)
+        max_iterations: int - default cap for conditions that are part of a loop
+        '''
         self.nodes = {}
         self.edges = {}
+        self.predecessors = {}
+        self.merge_funcs = {}
+        self.memoized = set()
         self.start_node = None
+        self.max_workers = max_workers
+        self.max_iterations = max_iterations
+        self._compiled = None
 
-    def add_task(self, node_id, task):
+    def add_task(self, node_id, task, merge_func=None, memoize=False):
+        '''
+        merge_func: function(results: dict) -> any
+        used when the node has several incoming edges (join node),
+        default is merge_results
+        memoize: bool - the task is idempotent (its result depends only on its input and it doesn't update memory),
+                 checkpointed runs reuse its result for the same input
+        '''
         self.nodes[node_id] = task
+        if merge_func is not None:
+            self.merge_funcs[node_id] = merge_func
+        if memoize:
+            self.memoized.add(node_id)
+        else:
+            self.memoized.discard(node_id)
+        self._compiled = None
 
-    def add_condition(self, node_id, condition_func):
-        condition_node = ConditionNode(condition_func)
+    def add_condition(self, node_id, condition_func=None, task=None, max_iterations=None):
+        '''
+        condition_func: function(result, memory) -> value
+        task: Task - classifier, used instead of condition_func (see ConditionNode)
+        max_iterations: int - cap on the number of times the condition routes in a run (loops)
+        '''
+        condition_node = ConditionNode(condition_func, task, max_iterations)
         self.nodes[node_id] = condition_node
+        self._compiled = None
+
+    def add_end(self, node_id):
+        self.nodes[node_id] = EndNode()
+        self._compiled = None
 
     def add_edge(self, from_node, to_node, condition=None):
         '''
@@ -37,76 +229,378 @@ class FlowGraph:
         to_node: str
         condition: any, depends on the condition function
         ** note that the condition is relevant only to ConditionNode **
-        regular nodes can have multiple outgoing edges,
-        ConditionNode can have as many as the possible values of the condition
+        regular nodes can have multiple outgoing edges - the branches run in parallel,
+        ConditionNode can have as many as the possible values of the condition (+ a default edge without a condition)
+        a node with multiple incoming edges is a join node - it waits for all of its predecessors
         '''
         if from_node in self.nodes:
             if isinstance(self.nodes[from_node], ConditionNode):
                 self.nodes[from_node].add_edge(condition, to_node)
         if from_node not in self.edges:
             self.edges[from_node] = []
-        self.edges[from_node].append((to_node, None)) 
+        self.edges[from_node].append((to_node, condition)) 
+        if to_node not in self.predecessors:
+            self.predecessors[to_node] = []
+        if from_node not in self.predecessors[to_node]:
+            self.predecessors[to_node].append(from_node)
+        self._compiled = None
 
     def set_start_node(self, node_id):
         self.start_node = node_id
+        self._compiled = None
 
-    def run(self, input, memory):
+    def compile(self):
         '''
-        input: str
-        memory: dict
-        iterate over the nodes and execute the tasks
-        end the iteration when reach a node that doesn't have an outgoing edge
-        '''
-        current_node = self.start_node
-        result = input
-        while current_node is not None:
-            node = self.nodes[current_node]
-            if isinstance(node, Task):
-                result = node.execute(result=result, memory=memory)
-                print(f"Task {current_node} executed successfully.\nResult:\n{result}\n---------------------------------\n")
-                next_node = None
-                if current_node in self.edges:
-                    next_node = self.edges[current_node][0][0]
-                current_node = next_node
-            elif isinstance(node, ConditionNode):
-                next_node = node.get_next_node(result, memory)
-                current_node = next_node
+        validate the graph and build its transition table (cached until the graph changes)
+        raises ValueError for: missing start node, edges to unknown nodes, conditions without a function,
+        end nodes with outgoing edges, nodes not reachable from the start node, cycles without a condition
+        '''
+        if self._compiled is not None:
+            return self._compiled
+        if self.start_node is None or self.start_node not in self.nodes:
+            raise ValueError(f"start node not found: {self.start_node}")
+
+        node_ids = list(self.nodes)
+        index = {node_id: position for position, node_id in enumerate(node_ids)}
+        for from_node, edges in self.edges.items():
+            for to_node, _ in edges:
+                if from_node not in index or to_node not in index:
+                    raise ValueError(f"edge between unknown nodes: {from_node} -> {to_node}")
+
+        graph = CompiledGraph()
+        graph.node_ids = tuple(node_ids)
+        graph.index = index
+        graph.nodes = tuple(self.nodes[node_id] for node_id in node_ids)
+        graph.start = index[self.start_node]
+        kinds, successors, routes, defaults, max_iterations = [], [], [], [], []
+        for node_id, node in zip(node_ids, graph.nodes):
+            if isinstance(node, ConditionNode):
+                if node.condition_function is None and node.task is None:
+                    raise ValueError(f"condition node without a condition: {node_id}")
+                normalize = normalize_label if node.task is not None else (lambda value: value)
+                node_routes = {normalize(condition): index[to_node] for condition, to_node in node.edges.items() if condition is not None}
+                kinds.append(CONDITION)
+                routes.append(node_routes)
+                defaults.append(index[node.edges[None]] if None in node.edges else -1)
+                successors.append(tuple(dict.fromkeys(node_routes.values())) + ((defaults[-1],) if defaults[-1] >= 0 else ()))
+                max_iterations.append(node.max_iterations)
+            elif isinstance(node, EndNode):
+                if self.edges.get(node_id):
+                    raise ValueError(f"end node with outgoing edges: {node_id}")
+                kinds.append(END)
+                routes.append(None)
+                defaults.append(-1)
+                successors.append(())
+                max_iterations.append(None)
             else:
-                break
-        return result
+                kinds.append(TASK)
+                routes.append(None)
+                defaults.append(-1)
+                successors.append(tuple(dict.fromkeys(index[to_node] for to_node, _ in self.edges.get(node_id, []))))
+                max_iterations.append(None)
+
+        # depth first search from the start node: reachability and back edges (loops)
+        back_edges = set()
+        visited = [False] * len(node_ids)
+        on_stack = [False] * len(node_ids)
+        path = []
+        stack = [(graph.start, iter(successors[graph.start]))]
+        visited[graph.start] = on_stack[graph.start] = True
+        path.append(graph.start)
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                path.pop()
+                on_stack[node] = False
+                continue
+            if on_stack[child]:
+                cycle = path[path.index(child):]
+                conditions = [member for member in cycle if kinds[member] == CONDITION]
+                if not conditions:
+                    raise ValueError("cycle without a condition: " + " -> ".join(node_ids[member] for member in cycle + [child]))
+                for member in conditions:
+                    if max_iterations[member] is None:
+                        max_iterations[member] = self.max_iterations
+                back_edges.add((node, child))
+            elif not visited[child]:
+                visited[child] = on_stack[child] = True
+                path.append(child)
+                stack.append((child, iter(successors[child])))
+        unreachable = [node_ids[position] for position, seen in enumerate(visited) if not seen]
+        if unreachable:
+            raise ValueError(f"nodes not reachable from the start node: {', '.join(map(str, unreachable))}")
+
+        join_predecessors = [[] for _ in node_ids]
+        for to_node, from_nodes in self.predecessors.items():
+            for from_node in from_nodes:
+                if (index[from_node], index[to_node]) not in back_edges:
+                    join_predecessors[index[to_node]].append(index[from_node])
+
+        graph.kinds = tuple(kinds)
+        graph.successors = tuple(successors)
+        graph.routes = tuple(routes)
+        graph.defaults = tuple(defaults)
+        graph.max_iterations = tuple(max_iterations)
+        graph.join_predecessors = tuple(tuple(predecessors) for predecessors in join_predecessors)
+        graph.memoize = tuple(node_id in self.memoized for node_id in node_ids)
+        graph.chains = self._chains(graph)
+        self._compiled = graph
+        return graph
 
-    def visualize(self, filename="flowgraph.png"):
+    def _chains(self, graph):
         '''
-        visualize the flow graph using networkx and matplotlib
+        straight-line task chains: task j is fused after task i if j is the only successor of i,
+        i is the only predecessor of j and neither is memoized
         '''
-        G = nx.DiGraph()
+        def fusable(index):
+            successors = graph.successors[index]
+            if graph.kinds[index] != TASK or graph.memoize[index] or len(successors) != 1:
+                return -1
+            follower = successors[0]
+            if graph.kinds[follower] != TASK or graph.memoize[follower] or follower == graph.start:
+                return -1
+            if self.predecessors.get(graph.node_ids[follower]) != [graph.node_ids[index]]:
+                return -1
+            return follower
 
-        for node_id, node in self.nodes.items():
-            label = f"{node_id}\n({node.agent.name})" if isinstance(node, Task) else node_id
-            shape = "ellipse" if isinstance(node, Task) else "diamond"
-            G.add_node(node_id, label=label, shape=shape)
-        
-        for from_node, edges in self.edges.items():
-            for to_node, condition in edges:
-                label = str(condition) if condition is not None else ""
-                G.add_edge(from_node, to_node, label=label)
-        
-        for node_id, node in self.nodes.items():
-            if isinstance(node, ConditionNode):
-                for condition, next_node in node.edges.items():
-                    label = str(condition)
-                    G.add_edge(node_id, next_node, label=label)
+        chains = []
+        for index in range(len(graph.node_ids)):
+            chain = []
+            follower = fusable(index)
+            # task cycles are rejected by compile, so a chain ends
+            while follower >= 0:
+                chain.append(follower)
+                follower = fusable(follower)
+            chains.append(tuple(chain))
+        return tuple(chains)
+
+    def _merge(self, graph, index, arrived):
+        '''
+        arrived: dict - predecessor index -> result
+        a single result is passed as is, several results go through the node's merge function
+        '''
+        if len(arrived) == 1:
+            return next(iter(arrived.values()))
+        ordered = {graph.node_ids[pred]: arrived[pred] for pred in graph.join_predecessors[index] if pred in arrived}
+        return self.merge_funcs.get(graph.node_ids[index], merge_results)(ordered)
+
+    def _execute_node(self, graph, index, input, memory, checkpoint=None):
+        '''
+        returns (result, condition value)
+        '''
+        kind = graph.kinds[index]
+        node = graph.nodes[index]
+        node_id = graph.node_ids[index]
+        if kind == TASK:
+            memoize = checkpoint is not None and graph.memoize[index]
+            if memoize:
+                found, result = checkpoint.memo_get(node_id, input)
+                if found:
+                    return result, None
+            with tracer.span("node", node_id, agent=node.agent.name):
+                result = node.execute(result=input, memory=memory)
+            if tracer.verbose:
+                print(f"Task {node_id} executed successfully.\nResult:\n{result}\n---------------------------------\n")
+            if memoize:
+                checkpoint.memo_set(node_id, input, result)
+            return result, None
+        if kind == CONDITION:
+            # condition nodes pass the result through to the chosen branch
+            if node.task is not None:
+                with tracer.span("node", node_id, agent=node.task.agent.name):
+                    return input, normalize_label(node.task.execute(result=input, memory=memory))
+            return input, node.condition_function(input, memory)
+        return input, None
+
+    def _execute_unit(self, graph, index, input, memory, checkpoint=None):
+        '''
+        execute a node and the tasks fused after it, returns (index of the last node, result, condition value)
+        checkpointed runs don't fuse - they save a checkpoint after every node
+        '''
+        result, value = self._execute_node(graph, index, input, memory, checkpoint)
+        if checkpoint is None:
+            for follower in graph.chains[index]:
+                result, value = self._execute_node(graph, follower, result, memory)
+                index = follower
+        return index, result, value
+
+    async def _aexecute_unit(self, graph, index, input, memory, emit=None, checkpoint=None):
+        result, value = await self._aexecute_node(graph, index, input, memory, emit, checkpoint)
+        if checkpoint is None:
+            for follower in graph.chains[index]:
+                result, value = await self._aexecute_node(graph, follower, result, memory, emit)
+                index = follower
+        return index, result, value
 
-        pos = nx.spring_layout(G)
-        labels = nx.get_node_attributes(G, 'label')
-        edge_labels = nx.get_edge_attributes(G, 'label')
+    async def _aexecute_node(self, graph, index, input, memory, emit=None, checkpoint=None):
+        kind = graph.kinds[index]
+        node = graph.nodes[index]
+        node_id = graph.node_ids[index]
+        task = node if kind == TASK else getattr(node, "task", None)
+        if task is None:
+            if kind == CONDITION:
+                return input, node.condition_function(input, memory)
+            return input, None
 
-        nx.draw(G, pos, labels=labels, with_labels=True, node_size=3000, node_color='skyblue', font_size=10, font_weight='bold', edge_color='gray')
-        nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_color='red')
+        memoize = checkpoint is not None and graph.memoize[index]
+        if memoize:
+            found, result = await asyncio.to_thread(checkpoint.memo_get, node_id, input)
+            if found:
+                return result, None
 
-        plt.savefig(filename)
-        plt.show()
-        print(f"Graph visualization saved as {filename}")
+        node_emit = None
+        if emit is not None:
+            node_emit = lambda event: emit({**event, "node": node_id})
+            emit({"event": "node_start", "node": node_id})
+        with tracer.span("node", node_id, agent=task.agent.name):
+            result = await task.aexecute(result=input, memory=memory, emit=node_emit)
+        if tracer.verbose:
+            print(f"Task {node_id} executed successfully.\nResult:\n{result}\n---------------------------------\n")
+        if emit is not None:
+            emit({"event": "node_end", "node": node_id, "result": result})
+        if kind == CONDITION:
+            return input, normalize_label(result)
+        if memoize:
+            await asyncio.to_thread(checkpoint.memo_set, node_id, input, result)
+        return result, None
 
+    def _start(self, graph, input, checkpoint):
+        '''
+        returns the run state and the nodes that are ready - from the start node or from the checkpoint
+        '''
+        state = _RunState(self, graph)
+        if checkpoint is not None and checkpoint.state is not None:
+            return state, state.restore(checkpoint.state)
+        return state, [(graph.start, input)]
 
+    def run(self, input, memory, checkpoint=None):
+        '''
+        input: str
+        memory: dict
+        execute the graph from the start node
+        sibling branches (multiple outgoing edges) run in parallel in a thread pool,
+        a join node runs once all of its predecessors are done
+        ** memory is shared between the branches **
+        returns the result of the terminal node (a node without an outgoing edge),
+        or the merged results if several terminal nodes were reached
+        checkpoint: RunCheckpoint (optional) - save a checkpoint after every node,
+                    a checkpoint with a state resumes the run from it (see checkpointStore.py)
+        '''
+        if self.start_node is None:
+            return input
+        graph = self.compile()
+        state, ready = self._start(graph, input, checkpoint)
+        in_flight = {}
+        executor = None
+        try:
+            while ready or in_flight:
+                completed = []
+                if len(ready) == 1 and not in_flight:
+                    # single branch - no need for the thread pool
+                    index, node_input = ready.pop()
+                    index, result, value = self._execute_unit(graph, index, node_input, memory, checkpoint)
+                    ready = state.deliver(index, state.next_nodes(index, value), result)
+                    completed.append((graph.node_ids[index], result))
+                else:
+                    if executor is None:
+                        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                    for index, node_input in ready:
+                        # copy the context so the spans of the branch get the right parent
+                        context = contextvars.copy_context()
+                        future = executor.submit(context.run, self._execute_unit, graph, index, node_input, memory, checkpoint)
+                        in_flight[future] = (index, node_input)
+                    ready = []
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        in_flight.pop(future)
+                        index, result, value = future.result()
+                        ready.extend(state.deliver(index, state.next_nodes(index, value), result))
+                        completed.append((graph.node_ids[index], result))
+                if not ready and not in_flight:
+                    ready = state.flush()
+                if checkpoint is not None:
+                    checkpoint.save(completed, state.snapshot(ready + list(in_flight.values())), memory)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        return state.result(input)
 
+    async def arun(self, input, memory, emit=None, checkpoint=None):
+        '''
+        async version of run - tasks are awaited so the event loop
+        is free while waiting for the llm, sibling branches run as concurrent asyncio tasks
+        emit: function(event: dict) - receives node_start / token / node_end events (see astream)
+        checkpoint: RunCheckpoint (optional) - see run
+        '''
+        if self.start_node is None:
+            return input
+        graph = self.compile()
+        state, ready = self._start(graph, input, checkpoint)
+        in_flight = {}
+        try:
+            while ready or in_flight:
+                completed = []
+                if len(ready) == 1 and not in_flight:
+                    index, node_input = ready.pop()
+                    index, result, value = await self._aexecute_unit(graph, index, node_input, memory, emit, checkpoint)
+                    ready = state.deliver(index, state.next_nodes(index, value), result)
+                    completed.append((graph.node_ids[index], result))
+                else:
+                    for index, node_input in ready:
+                        future = asyncio.ensure_future(self._aexecute_unit(graph, index, node_input, memory, emit, checkpoint))
+                        in_flight[future] = (index, node_input)
+                    ready = []
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        in_flight.pop(future)
+                        index, result, value = future.result()
+                        ready.extend(state.deliver(index, state.next_nodes(index, value), result))
+                        completed.append((graph.node_ids[index], result))
+                if not ready and not in_flight:
+                    ready = state.flush()
+                if checkpoint is not None:
+                    # the snapshot is taken here, the write happens off the event loop
+                    snapshot = state.snapshot(ready + list(in_flight.values()))
+                    await asyncio.to_thread(checkpoint.save, completed, snapshot, json_copy(memory))
+        finally:
+            for future in in_flight:
+                future.cancel()
+        return state.result(input)
+
+    async def astream(self, input, memory, checkpoint=None):
+        '''
+        run the graph and yield its events as they happen:
+        {"event": "node_start", "node": node_id}
+        {"event": "token", "node": node_id, "step": step_index, "content": token}
+        {"event": "node_end", "node": node_id, "result": result}
+        {"event": "end", "result": result} - always the last event
+        '''
+        queue = asyncio.Queue()
+
+        async def run():
+            try:
+                return await self.arun(input, memory, emit=queue.put_nowait, checkpoint=checkpoint)
+            finally:
+                queue.put_nowait(None)
+
+        run_task = asyncio.ensure_future(run())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            result = await run_task
+        finally:
+            if not run_task.done():
+                run_task.cancel()
+        yield {"event": "end", "result": result}
+
+    def visualize(self, filename="flowgraph.png", show=True):
+        '''
+        visualize the flow graph using networkx and matplotlib (see buildingBlocks/visualization.py)
+        '''
+        from buildingBlocks.visualization import visualize_flow_graph
+        visualize_flow_graph(self, filename, show=show)
@@ -11,6 +11,7 @@ class Task:
     Each step is a dictionary that contains some fields.
     The type field is mandatory.
     the types defined in the toolsFactory.py file.
+    (a TaskPlan from the TaskFunctionFactory is such a function - its steps are built once)
     '''
 
     def __init__(self, agent, function):
@@ -23,7 +24,13 @@ class Task:
 
     def execute(self, result, memory):
         steps = self.function(result, memory)
-        response = self.agent.execute(steps=steps)
+        response = self.agent.execute(steps=steps, task_input=result, memory=memory)
+        return response
+
+    async def aexecute(self, result, memory, emit=None):
+        '''
+        emit: function(event: dict) - receives the streaming events of the task (optional)
+        '''
+        steps = self.function(result, memory)
+        response = await self.agent.aexecute(steps=steps, task_input=result, memory=memory, emit=emit)
         return response
-    
-    
\ No newline at end of file
@@ -0,0 +1,298 @@
+'''
+structured instrumentation for the framework
+
+spans are recorded for the workflow, every node, every step, llm call and tool call.
+a span has monotonic timings (time.perf_counter), attributes (e.g. token counts) and an error if one was raised.
+the parent of a span is the span that was open when it started (tracked with a context variable,
+so it follows asyncio tasks and the flow graph's worker threads).
+
+finished spans go to the exporters:
+- RingBufferExporter: the last N spans in memory
+- JsonlExporter: one json line per span in a file
+- PrometheusExporter: duration summaries (p50/p90/p99), error, token and event (cache hits, retries, rate limits) counters
+  and the prompt cache hit ratio per node, in the prometheus text format
+
+usage:
+    from buildingBlocks.tracing import tracer, RingBufferExporter
+    tracer.add_exporter(RingBufferExporter(maxlen=10000))
+    tracer.verbose = False  # turn off the printing of step / task results
+'''
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import itertools
+import json
+import threading
+import time
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_node = contextvars.ContextVar("current_node", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "kind", "name", "attributes", "start", "end", "error")
+
+    def __init__(self, kind, name, parent_id, attributes):
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _Capture:
+    '''
+    stands in for the open span while attributes are captured (see Tracer.capture)
+    '''
+    __slots__ = ("span_id", "attributes")
+
+    def __init__(self):
+        self.span_id = None
+        self.attributes = {}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    '''
+    verbose: bool - print step and task results (the framework's debug output)
+    spans are only recorded when at least one exporter is added
+    '''
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.exporters = []
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    @contextmanager
+    def span(self, kind, name, **attributes):
+        '''
+        with tracer.span("node", node_id) as span:
+            ...
+        yields None when tracing is off
+        '''
+        if not self.exporters:
+            yield None
+            return
+        parent = _current_span.get()
+        if kind == "llm" and "node" not in attributes:
+            # llm calls are attributed to their node (prompt cache hit ratio per node)
+            node = _current_node.get()
+            if node is not None:
+                attributes["node"] = node
+        span = Span(kind, str(name), parent.span_id if parent is not None else None, attributes)
+        token = _current_span.set(span)
+        node_token = _current_node.set(span.name) if kind == "node" else None
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.perf_counter()
+            if node_token is not None:
+                _current_node.reset(node_token)
+            _current_span.reset(token)
+            for exporter in self.exporters:
+                exporter.export(span)
+
+    def record(self, **attributes):
+        '''
+        set attributes on the span that is currently open (if any)
+        '''
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    @contextmanager
+    def capture(self):
+        '''
+        with tracer.capture() as attributes:
+            ...
+        collects the attributes recorded in the block instead of setting them on the open span,
+        so they can be recorded later in another context (a call shared by several callers, see llm/batcher.py)
+        '''
+        capture = _Capture()
+        token = _current_span.set(capture)
+        try:
+            yield capture.attributes
+        finally:
+            _current_span.reset(token)
+
+    def record_usage(self, usage):
+        '''
+        usage: the usage field of an openai response
+        cached_tokens: the prompt tokens served from the provider's prompt cache
+        '''
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        attributes = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+            "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        }
+        self.record(**attributes)
+
+
+class RingBufferExporter:
+    def __init__(self, maxlen=10000):
+        self.buffer = deque(maxlen=maxlen)
+
+    def export(self, span):
+        self.buffer.append(span)
+
+    def spans(self, limit=None):
+        spans = list(self.buffer)
+        return spans[-limit:] if limit else spans
+
+
+class JsonlExporter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusExporter:
+    '''
+    aggregates spans per (kind, name)
+    quantiles are computed over the last reservoir_size durations
+    '''
+    QUANTILES = (0.5, 0.9, 0.99)
+    # numeric span attributes summed into agent_span_events_total
+    COUNTED_ATTRIBUTES = ("cache_hit", "retries", "rate_limited", "rate_limit_wait")
+
+    def __init__(self, reservoir_size=1024):
+        self.reservoir_size = reservoir_size
+        self.lock = threading.Lock()
+        self.series = {}  # (kind, name) -> {"count", "sum", "errors", "durations"}
+        self.tokens = {}  # (kind, name, type) -> count
+        self.events = {}  # (kind, name, attribute) -> sum
+        self.prompt_cache = {}  # node -> [prompt tokens, cached tokens]
+
+    def export(self, span):
+        key = (span.kind, span.name)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = {"count": 0, "sum": 0.0, "errors": 0, "durations": deque(maxlen=self.reservoir_size)}
+                self.series[key] = series
+            duration = span.end - span.start
+            series["count"] += 1
+            series["sum"] += duration
+            series["durations"].append(duration)
+            if span.error is not None:
+                series["errors"] += 1
+            for token_type in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                if token_type in span.attributes:
+                    token_key = (span.kind, span.name, token_type)
+                    self.tokens[token_key] = self.tokens.get(token_key, 0) + span.attributes[token_type]
+            for attribute in self.COUNTED_ATTRIBUTES:
+                if attribute in span.attributes:
+                    event_key = (span.kind, span.name, attribute)
+                    self.events[event_key] = self.events.get(event_key, 0) + span.attributes[attribute]
+            if span.kind == "llm" and "prompt_tokens" in span.attributes:
+                counts = self.prompt_cache.setdefault(span.attributes.get("node"), [0, 0])
+                counts[0] += span.attributes["prompt_tokens"]
+                counts[1] += span.attributes.get("cached_tokens", 0)
+
+    def prompt_cache_stats(self):
+        '''
+        node -> prompt tokens, cached tokens and the hit ratio (llm calls outside a node are under None)
+        '''
+        with self.lock:
+            return {
+                node: {"prompt_tokens": prompt, "cached_tokens": cached, "hit_ratio": cached / prompt if prompt else 0.0}
+                for node, (prompt, cached) in self.prompt_cache.items()
+            }
+
+    def render(self):
+        with self.lock:
+            series = [(key, value["count"], value["sum"], value["errors"], sorted(value["durations"]))
+                      for key, value in self.series.items()]
+            tokens = list(self.tokens.items())
+            events = list(self.events.items())
+            prompt_cache = [(node, prompt, cached) for node, (prompt, cached) in self.prompt_cache.items()]
+
+        lines = [
+            "# HELP agent_span_duration_seconds Duration of workflows, nodes, steps, llm and tool calls.",
+            "# TYPE agent_span_duration_seconds summary",
+        ]
+        for (kind, name), count, total, _, durations in series:
+            labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+            for q in self.QUANTILES:
+                lines.append(f'agent_span_duration_seconds{{{labels},quantile="{q}"}} {_quantile(durations, q)}')
+            lines.append(f"agent_span_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"agent_span_duration_seconds_count{{{labels}}} {count}")
+
+        lines.append("# HELP agent_span_errors_total Spans that ended with an error.")
+        lines.append("# TYPE agent_span_errors_total counter")
+        for (kind, name), _, _, errors, _ in series:
+            lines.append(f'agent_span_errors_total{{kind="{_escape(kind)}",name="{_escape(name)}"}} {errors}')
+
+        lines.append("# HELP agent_llm_tokens_total Tokens reported by the llm provider.")
+        lines.append("# TYPE agent_llm_tokens_total counter")
+        for (kind, name, token_type), count in tokens:
+            lines.append(f'agent_llm_tokens_total{{kind="{_escape(kind)}",name="{_escape(name)}",type="{token_type}"}} {count}')
+
+        lines.append("# HELP agent_span_events_total Cache hits, llm retries, rate limits and rate limit wait (seconds).")
+        lines.append("# TYPE agent_span_events_total counter")
+        for (kind, name, attribute), count in events:
+            lines.append(f'agent_span_events_total{{kind="{_escape(kind)}",name="{_escape(name)}",event="{attribute}"}} {float(count)}')
+
+        lines.append("# HELP agent_prompt_cache_hit_ratio Share of the prompt tokens served from the provider's prompt cache, per node.")
+        lines.append("# TYPE agent_prompt_cache_hit_ratio gauge")
+        for node, prompt, cached in prompt_cache:
+            lines.append(f'agent_prompt_cache_hit_ratio{{node="{_escape(node if node is not None else "")}"}} {cached / prompt if prompt else 0.0}')
+        return "\n".join(lines) + "\n"
+
+
+# the framework's tracer
+tracer = Tracer()
@@ -0,0 +1,44 @@
+'''
+drawing of flow graphs with networkx and matplotlib
+
+both are optional dependencies, imported only when a graph is drawn -
+importing the flow graph (and the api) doesn't pay for them.
+'''
+
+
+def visualize_flow_graph(flow_graph, filename="flowgraph.png", show=True):
+    '''
+    visualize the flow graph using networkx and matplotlib
+    '''
+    try:
+        import networkx as nx
+        import matplotlib.pyplot as plt
+    except ImportError as e:
+        raise ImportError("visualization needs networkx and matplotlib: pip install networkx matplotlib") from e
+    from buildingBlocks.task import Task
+
+    G = nx.DiGraph()
+
+    for node_id, node in flow_graph.nodes.items():
+        label = f"{node_id}\n({node.agent.name})" if isinstance(node, Task) else node_id
+        shape = "ellipse" if isinstance(node, Task) else "diamond"
+        G.add_node(node_id, label=label, shape=shape)
+
+    # condition edges are in flow_graph.edges too, with their condition
+    for from_node, edges in flow_graph.edges.items():
+        for to_node, condition in edges:
+            label = str(condition) if condition is not None else ""
+            G.add_edge(from_node, to_node, label=label)
+
+    pos = nx.spring_layout(G)
+    labels = nx.get_node_attributes(G, 'label')
+    edge_labels = nx.get_edge_attributes(G, 'label')
+
+    nx.draw(G, pos, labels=labels, with_labels=True, node_size=3000, node_color='skyblue', font_size=10, font_weight='bold', edge_color='gray')
+    nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_color='red')
+
+    plt.savefig(filename)
+    if show:
+        plt.show()
+    plt.close()
+    print(f"Graph visualization saved as {filename}")
@@ -0,0 +1,191 @@
+'''
+durable checkpoints of workflow runs
+
+after every node a run saves a checkpoint: the results of the nodes that finished,
+the routing state of the flow graph (pending nodes and their inputs, waiting joins, loop counters,
+terminal results) and a snapshot of the memory.
+a failed run can be resumed from its last checkpoint - only the nodes that were pending run again.
+
+nodes marked as memoize (idempotent - their result depends only on their input) are also
+memoized by (workflow, node id, input), so a retried run doesn't pay for them again.
+
+usage:
+    store = SQLiteCheckpointStore("checkpoints.sqlite")
+    checkpoint = store.create_run(run_id, workflow_id, session_id, user_input, memory)
+    flowGraph.run(user_input, memory, checkpoint=checkpoint)
+    store.finish(run_id, "completed")
+    ...
+    checkpoint = store.checkpoint(run_id)  # resume: checkpoint.memory, checkpoint.state
+'''
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def serialize(value):
+    return json.dumps(value, default=str)
+
+
+def memo_key(namespace, node_id, input):
+    return hashlib.sha256(serialize([namespace, node_id, input]).encode()).hexdigest()
+
+
+class RunCheckpoint:
+    '''
+    the checkpoint of a single run, passed to FlowGraph.run / arun
+    state: dict - the routing state of the last checkpoint (None - the run starts from the start node)
+    memory: dict - the memory snapshot of the last checkpoint
+    '''
+    def __init__(self, store, run_id, namespace, state=None, memory=None):
+        self.store = store
+        self.run_id = run_id
+        self.namespace = namespace
+        self.state = state
+        self.memory = memory
+
+    def save(self, completed, state, memory):
+        '''
+        completed: list of (node id, result) that finished since the last checkpoint
+        '''
+        self.state = state
+        self.store.save(self.run_id, completed, state, memory)
+
+    def memo_get(self, node_id, input):
+        '''
+        returns (found, result)
+        '''
+        return self.store.memo_get(memo_key(self.namespace, node_id, input))
+
+    def memo_set(self, node_id, input, result):
+        self.store.memo_set(memo_key(self.namespace, node_id, input), result)
+
+
+class SQLiteCheckpointStore:
+    '''
+    path: sqlite file (WAL mode)
+    memo_ttl: seconds a memoized node result is valid (None - forever)
+    '''
+    def __init__(self, path="checkpoints.sqlite", memo_ttl=None):
+        self.path = path
+        self.memo_ttl = memo_ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id TEXT PRIMARY KEY, workflow_id TEXT, session_id TEXT, user_input TEXT, status TEXT NOT NULL,"
+            "state TEXT, memory TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "run_id TEXT NOT NULL, seq INTEGER NOT NULL, node_id TEXT NOT NULL, result TEXT, created REAL NOT NULL,"
+            "PRIMARY KEY (run_id, seq));"
+            "CREATE TABLE IF NOT EXISTS node_memo (key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL);"
+        )
+
+    def _write(self, statements):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in statements:
+                    self.connection.execute(sql, parameters)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def create_run(self, run_id, workflow_id, session_id, user_input, memory):
+        '''
+        save the initial checkpoint (memory before the run) and return the run's checkpoint
+        '''
+        now = time.time()
+        self._write([(
+            "INSERT INTO runs (run_id, workflow_id, session_id, user_input, status, state, memory, created, updated) "
+            "VALUES (?, ?, ?, ?, 'running', NULL, ?, ?, ?)",
+            (run_id, workflow_id, session_id, user_input, serialize(memory), now, now)
+        )])
+        return RunCheckpoint(self, run_id, workflow_id)
+
+    def save(self, run_id, completed, state, memory):
+        now = time.time()
+        with self.lock:
+            last_seq = self.connection.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM checkpoints WHERE run_id = ?", (run_id,)).fetchone()[0]
+        statements = [
+            ("INSERT INTO checkpoints (run_id, seq, node_id, result, created) VALUES (?, ?, ?, ?, ?)",
+             (run_id, last_seq + position, node_id, serialize(result), now))
+            for position, (node_id, result) in enumerate(completed, start=1)
+        ]
+        statements.append((
+            "UPDATE runs SET state = ?, memory = ?, updated = ? WHERE run_id = ?",
+            (serialize(state), serialize(memory), now, run_id)
+        ))
+        self._write(statements)
+
+    def finish(self, run_id, status, error=None):
+        '''
+        status: "completed" (the checkpoints are dropped) / "failed" (kept for resume)
+        '''
+        statements = [("UPDATE runs SET status = ?, error = ?, updated = ? WHERE run_id = ?", (status, error, time.time(), run_id))]
+        if status == "completed":
+            statements.append(("UPDATE runs SET state = NULL, memory = NULL WHERE run_id = ?", (run_id,)))
+            statements.append(("DELETE FROM checkpoints WHERE run_id = ?", (run_id,)))
+        self._write(statements)
+
+    def get_run(self, run_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT workflow_id, session_id, user_input, status, error, created, updated FROM runs WHERE run_id = ?",
+                (run_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            nodes = self.connection.execute(
+                "SELECT node_id FROM checkpoints WHERE run_id = ? ORDER BY seq", (run_id,)).fetchall()
+        workflow_id, session_id, user_input, status, error, created, updated = row
+        return {
+            "run_id": run_id, "workflow_id": workflow_id, "session_id": session_id, "user_input": user_input,
+            "status": status, "error": error, "created": created, "updated": updated,
+            "completed_nodes": [node_id for (node_id,) in nodes],
+        }
+
+    def checkpoint(self, run_id):
+        '''
+        the last checkpoint of a run (to resume it), None if the run is unknown
+        '''
+        with self.lock:
+            row = self.connection.execute("SELECT workflow_id, state, memory FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        workflow_id, state, memory = row
+        return RunCheckpoint(self, run_id, workflow_id,
+                             state=json.loads(state) if state else None,
+                             memory=json.loads(memory) if memory else None)
+
+    def delete_run(self, run_id):
+        self._write([
+            ("DELETE FROM runs WHERE run_id = ?", (run_id,)),
+            ("DELETE FROM checkpoints WHERE run_id = ?", (run_id,)),
+        ])
+
+    def prune(self, max_age):
+        '''
+        drop runs (and memoized results) older than max_age seconds
+        '''
+        cutoff = time.time() - max_age
+        self._write([
+            ("DELETE FROM checkpoints WHERE run_id IN (SELECT run_id FROM runs WHERE updated < ?)", (cutoff,)),
+            ("DELETE FROM runs WHERE updated < ?", (cutoff,)),
+            ("DELETE FROM node_memo WHERE created < ?", (cutoff,)),
+        ])
+
+    def memo_get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT result, created FROM node_memo WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.memo_ttl is not None and time.time() - row[1] > self.memo_ttl):
+            return False, None
+        return True, json.loads(row[0])
+
+    def memo_set(self, key, result):
+        self._write([("INSERT OR REPLACE INTO node_memo (key, result, created) VALUES (?, ?, ?)", (key, serialize(result), time.time()))])
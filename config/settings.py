@@ -1,18 +1,256 @@
 import os
 
+from buildingBlocks.tracing import tracer
+from llm.clients import llm_clients, estimate_request_tokens
+
 # openai
+# every call goes through llm_clients (llm/clients.py) - one pooled client per process,
+# per-model rate limits and retries
+def configure_llm_clients():
+    '''
+    configured from the environment:
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE, LLM_KEEPALIVE_EXPIRY: connection pool
+    LLM_TIMEOUT, LLM_CONNECT_TIMEOUT: seconds, LLM_MAX_RETRIES: retries with jitter
+    LLM_RPM, LLM_TPM: default requests / tokens per minute per model (unset - unlimited)
+    LLM_MODEL_LIMITS: per-model overrides "model=rpm:tpm", e.g. "gpt-4o=500:30000,gpt-4o-mini=5000:2000000"
+    '''
+    default_limits = {}
+    if os.environ.get("LLM_RPM"):
+        default_limits["requests_per_minute"] = int(os.environ["LLM_RPM"])
+    if os.environ.get("LLM_TPM"):
+        default_limits["tokens_per_minute"] = int(os.environ["LLM_TPM"])
+    model_limits = {}
+    for item in os.environ.get("LLM_MODEL_LIMITS", "").split(","):
+        if item.strip():
+            model, limits = item.split("=")
+            rpm, _, tpm = limits.partition(":")
+            model_limits[model.strip()] = {
+                "requests_per_minute": int(rpm) if rpm else None,
+                "tokens_per_minute": int(tpm) if tpm else None,
+            }
+    llm_clients.configure(
+        max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.environ.get("LLM_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 30)),
+        timeout=float(os.environ.get("LLM_TIMEOUT", 60)),
+        connect_timeout=float(os.environ.get("LLM_CONNECT_TIMEOUT", 5)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 3)),
+        default_limits=default_limits,
+        model_limits=model_limits
+    )
+    return llm_clients
+
 def import_client():
     # api_key = os.environ["OPENAI_API_KEY"]
-    from openai import OpenAI
     from dotenv import load_dotenv
     load_dotenv()
-    return OpenAI()
+    return configure_llm_clients().client()
+
+def import_async_client():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return configure_llm_clients().async_client()
 
-def interact_with_agent(llm_client, messages, model):
-    response = llm_client.chat.completions.create(
-            model=model,
-            messages=messages
+def make_llm_cache():
+    '''
+    response cache for the interact functions, configured from the environment:
+    LLM_CACHE: "memory" / "sqlite" (unset - no cache)
+    LLM_CACHE_SIZE: max entries, LLM_CACHE_TTL: seconds, LLM_CACHE_PATH: sqlite file
+    '''
+    from llm.responseCache import LLMCache, LRUCacheBackend, SQLiteCacheBackend
+    backend_name = os.environ.get("LLM_CACHE", "").lower()
+    if not backend_name:
+        return None
+    ttl = float(os.environ["LLM_CACHE_TTL"]) if os.environ.get("LLM_CACHE_TTL") else None
+    if backend_name == "memory":
+        backend = LRUCacheBackend(max_size=int(os.environ.get("LLM_CACHE_SIZE", 1024)), ttl=ttl)
+    elif backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            path=os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite"),
+            max_size=int(os.environ.get("LLM_CACHE_SIZE", 100000)),
+            ttl=ttl
         )
+    else:
+        raise ValueError(f"unknown LLM_CACHE backend: {backend_name}")
+    return LLMCache(backend)
+
+def make_llm_batcher():
+    '''
+    micro-batching / rate limiting of the llm calls, configured from the environment:
+    LLM_BATCH: "1" to enable (unset - every step calls the provider directly)
+    LLM_BATCH_WINDOW_MS, LLM_BATCH_MAX: gathering window and max batch size
+    LLM_CONCURRENCY: max calls in flight per model
+    LLM_MODEL_CONCURRENCY: per-model overrides, e.g. "gpt-4o=4,gpt-4o-mini=16"
+    '''
+    if os.environ.get("LLM_BATCH", "") in ("", "0"):
+        return None
+    from llm.batcher import LLMBatcher
+    model_concurrency = {}
+    for item in os.environ.get("LLM_MODEL_CONCURRENCY", "").split(","):
+        if item.strip():
+            model, limit = item.split("=")
+            model_concurrency[model.strip()] = int(limit)
+    return LLMBatcher(
+        window=float(os.environ.get("LLM_BATCH_WINDOW_MS", 5)) / 1000,
+        max_batch=int(os.environ.get("LLM_BATCH_MAX", 32)),
+        concurrency=int(os.environ.get("LLM_CONCURRENCY", 8)),
+        model_concurrency=model_concurrency
+    )
+
+def make_tool_executor():
+    '''
+    tool execution backend, configured from the environment:
+    TOOL_EXECUTOR: "process" (unset - tools run in-process)
+    TOOL_WORKERS, TOOL_TIMEOUT (seconds), TOOL_MEMORY_LIMIT_MB,
+    TOOL_CPU_LIMIT (cpu seconds per worker), TOOL_MAX_TASKS_PER_WORKER
+    '''
+    executor_name = os.environ.get("TOOL_EXECUTOR", "").lower()
+    if not executor_name:
+        return None
+    if executor_name != "process":
+        raise ValueError(f"unknown TOOL_EXECUTOR: {executor_name}")
+    from factories.toolExecutor import ProcessToolExecutor
+    memory_limit_mb = os.environ.get("TOOL_MEMORY_LIMIT_MB")
+    return ProcessToolExecutor(
+        processes=int(os.environ["TOOL_WORKERS"]) if os.environ.get("TOOL_WORKERS") else None,
+        default_timeout=float(os.environ.get("TOOL_TIMEOUT", 30)),
+        memory_limit=int(memory_limit_mb) * 1024 * 1024 if memory_limit_mb else None,
+        cpu_limit=int(os.environ["TOOL_CPU_LIMIT"]) if os.environ.get("TOOL_CPU_LIMIT") else None,
+        max_tasks_per_worker=int(os.environ.get("TOOL_MAX_TASKS_PER_WORKER", 100))
+    )
+
+def configure_tracing():
+    '''
+    tracing exporters and verbosity, configured from the environment:
+    AGENT_VERBOSE: "0" turns off the printing of step / task results
+    TRACE_JSONL: file to append finished spans to
+    returns (ring_buffer_exporter, prometheus_exporter) - always on, for the api endpoints
+    '''
+    from buildingBlocks.tracing import RingBufferExporter, JsonlExporter, PrometheusExporter
+    tracer.verbose = os.environ.get("AGENT_VERBOSE", "1") != "0"
+    ring_buffer = tracer.add_exporter(RingBufferExporter(maxlen=int(os.environ.get("TRACE_BUFFER_SIZE", 10000))))
+    prometheus = tracer.add_exporter(PrometheusExporter())
+    if os.environ.get("TRACE_JSONL"):
+        tracer.add_exporter(JsonlExporter(os.environ["TRACE_JSONL"]))
+    return ring_buffer, prometheus
+
+def make_memory_store():
+    '''
+    persistent session memory, configured from the environment:
+    MEMORY_STORE: "sqlite" (unset - sessions live only in process memory)
+    MEMORY_STORE_PATH: the sqlite file
+    '''
+    store_name = os.environ.get("MEMORY_STORE", "").lower()
+    if not store_name:
+        return None
+    if store_name != "sqlite":
+        raise ValueError(f"unknown MEMORY_STORE: {store_name}")
+    from memoryStore import SQLiteMemoryStore
+    return SQLiteMemoryStore(os.environ.get("MEMORY_STORE_PATH", "memory.sqlite"))
+
+def make_checkpoint_store():
+    '''
+    per-node checkpoints of the runs (resume with POST /runs/{run_id}/resume), configured from the environment:
+    CHECKPOINT_STORE: "sqlite" (unset - no checkpoints)
+    CHECKPOINT_STORE_PATH: the sqlite file, CHECKPOINT_MEMO_TTL: seconds memoized node results are valid
+    '''
+    store_name = os.environ.get("CHECKPOINT_STORE", "").lower()
+    if not store_name:
+        return None
+    if store_name != "sqlite":
+        raise ValueError(f"unknown CHECKPOINT_STORE: {store_name}")
+    from checkpointStore import SQLiteCheckpointStore
+    memo_ttl = os.environ.get("CHECKPOINT_MEMO_TTL")
+    return SQLiteCheckpointStore(os.environ.get("CHECKPOINT_STORE_PATH", "checkpoints.sqlite"),
+                                 memo_ttl=float(memo_ttl) if memo_ttl else None)
+
+def make_job_queue():
+    '''
+    the queue of background runs, configured from the environment:
+    JOB_WORKERS: runs executed at the same time, JOB_QUEUE_SIZE: waiting runs before /run answers 429
+    JOB_TENANT_CONCURRENCY: max running jobs per tenant (X-Tenant-ID header, unset - no limit)
+    JOB_TENANT_QUOTAS: per-tenant overrides, e.g. "free=1,pro=8"
+    JOB_RESULT_TTL: seconds the result of a finished job is kept
+    '''
+    from jobQueue import JobQueue
+    tenant_quotas = {}
+    for item in os.environ.get("JOB_TENANT_QUOTAS", "").split(","):
+        if item.strip():
+            tenant, quota = item.split("=")
+            tenant_quotas[tenant.strip()] = int(quota)
+    default_quota = os.environ.get("JOB_TENANT_CONCURRENCY")
+    return JobQueue(
+        workers=int(os.environ.get("JOB_WORKERS", 8)),
+        max_queued=int(os.environ.get("JOB_QUEUE_SIZE", 1000)),
+        default_quota=int(default_quota) if default_quota else None,
+        tenant_quotas=tenant_quotas,
+        result_ttl=float(os.environ.get("JOB_RESULT_TTL", 3600))
+    )
+
+def interact_with_agent(llm_client, messages, model, response_format=None, **kwargs):
+    '''
+    response_format: passed to the provider when given (structured outputs)
+    '''
+    request = {"response_format": response_format} if response_format is not None else {}
+    response = llm_clients.create(llm_client, model, messages, **request)
+    tracer.record_usage(response.usage)
     return response.choices[0].message.content
 
+async def ainteract_with_agent(llm_client, messages, model, on_token=None, response_format=None, **kwargs):
+    '''
+    async version of interact_with_agent, llm_client should be an AsyncOpenAI instance
+    on_token: function(token: str) - if given, the completion is streamed
+              and every token is passed to it as it arrives
+    '''
+    request = {"response_format": response_format} if response_format is not None else {}
+    if on_token is None:
+        response = await llm_clients.acreate(llm_client, model, messages, **request)
+        tracer.record_usage(response.usage)
+        return response.choices[0].message.content
+
+    stream = await llm_clients.acreate(
+            llm_client, model, messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **request
+        )
+    content = []
+    async for chunk in stream:
+        if chunk.usage is not None:
+            # the last chunk (no choices) carries the usage
+            tracer.record_usage(chunk.usage)
+            llm_clients.limits(model).settle(estimate_request_tokens(messages), chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            token = chunk.choices[0].delta.content
+            content.append(token)
+            on_token(token)
+    return "".join(content)
+
+def assistant_message(message):
+    '''
+    the assistant message of a response as a dict that can be sent back in messages
+    '''
+    result = {"role": "assistant", "content": message.content}
+    if message.tool_calls:
+        result["tool_calls"] = [
+            {"id": call.id, "type": "function", "function": {"name": call.function.name, "arguments": call.function.arguments}}
+            for call in message.tool_calls
+        ]
+    return result
+
+def interact_with_tools(llm_client, messages, model, tools, **kwargs):
+    '''
+    function calling: returns the assistant message (with tool_calls when the model calls tools)
+    kwargs: request fields such as tool_choice / parallel_tool_calls
+    '''
+    response = llm_clients.create(llm_client, model, messages, tools=tools, **kwargs)
+    tracer.record_usage(response.usage)
+    return assistant_message(response.choices[0].message)
 
+async def ainteract_with_tools(llm_client, messages, model, tools, **kwargs):
+    '''
+    async version of interact_with_tools
+    '''
+    response = await llm_clients.acreate(llm_client, model, messages, tools=tools, **kwargs)
+    tracer.record_usage(response.usage)
+    return assistant_message(response.choices[0].message)
@@ -0,0 +1,71 @@
+'''
+token-budgeted window over memory['conversation_history']
+
+the history keeps only the most recent turns that fit in max_tokens.
+older turns can be rolled into memory['conversation_summary'] by a summarizer
+(e.g. agent_summarizer(agent)), so templates stay constant-size:
+    "summary: {memory.get('conversation_summary')}\n history: {memory['conversation_history']}"
+'''
+
+# rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for english text
+    return len(text) // 4 + 1
+
+
+def make_token_counter(model="gpt-4o-mini"):
+    '''
+    returns a function(text) -> number of tokens
+    uses tiktoken when it is installed, an estimate otherwise
+    '''
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except ImportError:
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def agent_summarizer(agent, model="gpt-4o-mini"):
+    '''
+    summarizer that asks the agent's llm to fold the dropped turns into the running summary
+    '''
+    def summarize(summary, messages):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = (
+            "Update the summary of the conversation with the new messages. "
+            "Keep the facts, decisions and open questions, be concise.\n\n"
+            f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"
+        )
+        return agent.interact_func(
+            llm_client=agent.llm_client,
+            messages=[
+                {"role": "system", "content": agent.role},
+                {"role": "user", "content": prompt},
+            ],
+            model=model)
+    return summarize
+
+
+class HistoryWindow:
+    '''
+    configuration of the history window, shared by the sessions of a workflow
+    max_tokens: int - token budget of the conversation history
+    count_tokens: function(text) -> int (default - make_token_counter())
+    summarizer: function(summary, dropped_messages) -> new summary (optional)
+    min_messages: int - always keep at least this many recent messages
+    '''
+    def __init__(self, max_tokens=4000, count_tokens=None, summarizer=None, min_messages=1):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or make_token_counter()
+        self.summarizer = summarizer
+        self.min_messages = min_messages
+
+    def message_tokens(self, message):
+        return self.count_tokens(str(message["content"])) + MESSAGE_OVERHEAD_TOKENS
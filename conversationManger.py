@@ -1,34 +1,199 @@
 
+from collections import deque
+from buildingBlocks.tracing import tracer
+import asyncio
 import time
 
 
 class ConversationManager:
-    def __init__(self, flow_graph, id, memory=None):
+    '''
+    flow_graph: FlowGraph
+    id: conversation id
+    memory: dict - the memory of the conversation (default - empty history)
+    history_window: HistoryWindow (optional) - keep the conversation history within a token budget
+    '''
+    def __init__(self, flow_graph, id, memory=None, history_window=None):
         self.flow_graph = flow_graph
+        self.id = id
         self.memory = memory if memory is not None else {
             'user_input': None,
             'conversation_history': [],
         }
+        # approx. size of the conversation history (in characters)
+        self.size = sum(len(str(message["content"])) for message in self.memory['conversation_history'])
+        self.history_window = history_window
+        # token count of every message in the history (kept in sync by _append_history / _drop_old_turns)
+        self.history_tokens = deque()
+        self.history_token_total = 0
+        # history changes since they were last saved (for persistent memory stores, see history_delta)
+        self.history_appended = []
+        self.history_dropped = 0
        
 
     def set_id(self, conversation_id):
         self.memory['conversation id'] = conversation_id
 
+    def replace_memory(self, memory, rewrite_history=False):
+        '''
+        use memory loaded from outside (e.g. a persistent store) as the memory of the conversation
+        rewrite_history: the history differs from the persisted one (e.g. restored from a checkpoint),
+                         the next saved history delta replaces all of it
+        '''
+        self.memory = memory
+        self.size = sum(len(str(message["content"])) for message in memory['conversation_history'])
+        self.history_tokens = deque()
+        self.history_token_total = 0
+        self.history_appended = list(memory['conversation_history']) if rewrite_history else []
+        self.history_dropped = None if rewrite_history else 0
 
-    def run(self, user_input):
-        # start time
-        start_time = time.time()
+    def history_delta(self):
+        '''
+        returns (appended messages, number of dropped messages) since the history was last saved
+        dropped is None when the whole history was replaced (appended is then the full history)
+        '''
+        return list(self.history_appended), self.history_dropped
+
+    def history_saved(self):
+        '''
+        the delta returned by history_delta was written - the next one starts from here
+        '''
+        self.history_appended = []
+        self.history_dropped = 0
+
+    def _append_history(self, role, content):
+        message = {"role": role, "content": content}
+        self.memory['conversation_history'].append(message)
+        self.history_appended.append(message)
+        self.size += len(str(content))
+        if self.history_window is not None:
+            tokens = self.history_window.message_tokens(message)
+            self.history_tokens.append(tokens)
+            self.history_token_total += tokens
+
+    def _start_turn(self, user_input):
         self.memory['user_input'] = user_input
-        self.memory['conversation_history'].append({"role": "user", "content": user_input})
-        response = self.flow_graph.run(user_input, self.memory)
+        self._append_history("user", user_input)
+
+    def _end_turn(self, response):
+        '''
+        returns the old turns that are over the history window's budget (to be summarized and dropped, see _compact)
+        '''
         if response is not None or response != "":
-            self.memory['conversation_history'].append({"role": "assistant", "content": response})
+            self._append_history("assistant", response)
+        return self._old_turns()
+
+    def _old_turns(self):
+        if self.history_window is None:
+            return []
+        history = self.memory['conversation_history']
+        if len(self.history_tokens) != len(history):
+            # the history was replaced from outside - count it again
+            self.history_tokens = deque(self.history_window.message_tokens(message) for message in history)
+            self.history_token_total = sum(self.history_tokens)
+        total, count = self.history_token_total, 0
+        while total > self.history_window.max_tokens and len(history) - count > self.history_window.min_messages:
+            total -= self.history_tokens[count]
+            count += 1
+        return history[:count]
+
+    def _drop_old_turns(self, count):
+        history = self.memory['conversation_history']
+        for _ in range(count):
+            message = history.pop(0)
+            self.history_token_total -= self.history_tokens.popleft()
+            self.size -= len(str(message["content"]))
+        if self.history_dropped is None:
+            # the history is rewritten anyway
+            self.history_appended = self.history_appended[count:]
+        else:
+            self.history_dropped += count
+
+    def _compact(self, old_turns):
+        '''
+        roll the old turns into memory['conversation_summary'] and then drop them from the history.
+        if the summarizer fails, the turns are kept (and summarized with the next turn's) - the run still succeeds
+        '''
+        if not old_turns:
+            return
+        if self.history_window.summarizer is not None:
+            with tracer.span("workflow", "summarize", session=self.id) as span:
+                try:
+                    summary = self.history_window.summarizer(self.memory.get('conversation_summary'), old_turns)
+                except Exception as e:
+                    if span is not None:
+                        span.error = f"{type(e).__name__}: {e}"
+                    if tracer.verbose:
+                        print(f"summarizing the conversation history failed, the turns are kept: {e}")
+                    return
+            self.memory['conversation_summary'] = summary
+        self._drop_old_turns(len(old_turns))
+
+    def run(self, user_input, checkpoint=None):
+        '''
+        checkpoint: RunCheckpoint (optional) - checkpoint the run after every node (see checkpointStore.py)
+        '''
+        # start time
+        start_time = time.perf_counter()
+        self._start_turn(user_input)
+        with tracer.span("workflow", "run", session=self.id):
+            response = self.flow_graph.run(user_input, self.memory, checkpoint=checkpoint)
+        self._compact(self._end_turn(response))
         # end time
-        end_time = time.time()
+        end_time = time.perf_counter()
         run_time = end_time - start_time
         return response, run_time
     
+    async def arun(self, user_input, checkpoint=None):
+        start_time = time.perf_counter()
+        self._start_turn(user_input)
+        with tracer.span("workflow", "run", session=self.id):
+            response = await self.flow_graph.arun(user_input, self.memory, checkpoint=checkpoint)
+        old_turns = self._end_turn(response)
+        if old_turns:
+            await asyncio.to_thread(self._compact, old_turns)
+        end_time = time.perf_counter()
+        run_time = end_time - start_time
+        return response, run_time
+
+    async def aresume(self, checkpoint, user_input):
+        '''
+        resume a failed run from its last checkpoint:
+        the memory is restored from the checkpoint and only the nodes that didn't finish run again
+        (a run that failed before its first checkpoint starts over)
+        '''
+        self.replace_memory(checkpoint.memory, rewrite_history=True)
+        if checkpoint.state is None:
+            return await self.arun(user_input, checkpoint=checkpoint)
+        start_time = time.perf_counter()
+        with tracer.span("workflow", "resume", session=self.id):
+            response = await self.flow_graph.arun(user_input, self.memory, checkpoint=checkpoint)
+        old_turns = self._end_turn(response)
+        if old_turns:
+            await asyncio.to_thread(self._compact, old_turns)
+        end_time = time.perf_counter()
+        run_time = end_time - start_time
+        return response, run_time
+
+    async def astream(self, user_input, checkpoint=None):
+        '''
+        streaming version of arun - yields the flow graph events (see FlowGraph.astream),
+        the last event is {"event": "end", "response": ..., "run_time": ..., "session_id": ...}
+        '''
+        start_time = time.perf_counter()
+        self._start_turn(user_input)
+        response = None
+        with tracer.span("workflow", "stream", session=self.id):
+            async for event in self.flow_graph.astream(user_input, self.memory, checkpoint=checkpoint):
+                if event["event"] == "end":
+                    response = event["result"]
+                    break
+                yield event
+        old_turns = self._end_turn(response)
+        if old_turns:
+            await asyncio.to_thread(self._compact, old_turns)
+        end_time = time.perf_counter()
+        yield {"event": "end", "response": response, "run_time": end_time - start_time, "session_id": self.id}
+
     def run_out_of_conversation(self, user_input):
         response = self.flow_graph.run(user_input, self.memory)
         return response
-
@@ -7,9 +7,10 @@ class AgentsFactory:
     '''
     Factory class for creating agents
     '''
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, async_llm_client=None, tool_executor=None):
         self.llm_client = llm_client
-        self.toolsFactory = ToolsFactory()
+        self.async_llm_client = async_llm_client
+        self.toolsFactory = ToolsFactory(executor=tool_executor)
         self.step_handler = StepHandler()
         self.agents = {}
 
@@ -18,7 +19,10 @@ class AgentsFactory:
             name, 
             interact_func, 
             role, 
-            tools = None
+            tools = None,
+            ainteract_func = None,
+            tools_interact_func = None,
+            atools_interact_func = None
         ):
 
         '''
@@ -26,6 +30,8 @@ class AgentsFactory:
         interact_func: function
         role: str
         tools: list[str] - list of tool names
+        ainteract_func: coroutine function - used by the async execution path
+        tools_interact_func, atools_interact_func: function calling (llm_interact steps with useTools)
         '''
 
         agent = Agent(
@@ -33,7 +39,11 @@ class AgentsFactory:
             llm_client=self.llm_client, 
             interact_func=interact_func, 
             role=role, 
-            step_handler=self.step_handler
+            step_handler=self.step_handler,
+            async_llm_client=self.async_llm_client,
+            ainteract_func=ainteract_func,
+            tools_interact_func=tools_interact_func,
+            atools_interact_func=atools_interact_func
         )
         
         if tools is not None:
@@ -0,0 +1,362 @@
+'''
+safe expressions for workflow specs
+
+prompt placeholders ({memory['user_input']}) and tool inputs ('{"x": 1, "y": last_step_result}')
+come from workflow json - possibly generated by /generate or sent by users, so they are not eval'ed.
+an expression is parsed once and compiled into a tree of closures (function(context) -> value).
+
+supported:
+- names from the context (memory, task_input, last_step_result)
+- literals, dicts, lists, tuples, sets, f-strings
+- item access and slices: memory['key'][0], text[:100]
+- attribute access to public attributes: task_input.title
+- arithmetic, comparisons, and / or / not, x if cond else y
+- calls of the whitelisted FUNCTIONS and of the whitelisted METHODS of str / dict / list / tuple values
+
+anything else (private attributes, imports, lambdas, comprehensions, other calls) is an ExpressionError at compile time.
+
+usage:
+    expression = compile_expression("memory['user_input'].strip()")
+    expression({"memory": memory})
+'''
+import ast
+import operator
+import re
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+FUNCTIONS = {
+    "len": len, "str": lambda value="": to_str(value), "int": int, "float": float, "bool": bool,
+    "list": list, "dict": dict, "tuple": tuple,
+    "min": min, "max": max, "sum": lambda values, start=0: _sum(values, start), "abs": abs, "round": round,
+    "sorted": sorted, "any": any, "all": all,
+}
+
+METHODS = {
+    str: {"strip", "lstrip", "rstrip", "lower", "upper", "title", "capitalize", "split", "splitlines",
+          "join", "replace", "startswith", "endswith", "find", "count", "isdigit", "isalpha"},
+    dict: {"get", "keys", "values", "items"},
+    list: {"index", "count"},
+    tuple: {"index", "count"},
+}
+
+# the size of what an expression builds (nested elements included, see _size) is checked
+# before it is built where it can be estimated (*, +, **, str.replace / join, format widths, sum),
+# and after it is built otherwise (literals, str / repr / format) - an expression can't allocate unbounded memory
+MAX_SEQUENCE_LENGTH = 1000000
+MAX_EXPONENT = 1000
+MAX_INT_BITS = 100000
+
+# width and precision of a % format specification, e.g. %-10.2f
+PERCENT_SPEC = re.compile(r"%(?:\([^)]*\))?[#0 +\-]*(\*|\d*)(?:\.(\*|\d*))?")
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge, ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b, ast.Is: operator.is_, ast.IsNot: operator.is_not,
+}
+
+
+def _size(value):
+    '''
+    approx. size of a value: characters of strings, digits of numbers and one per element of containers.
+    nested elements count every time they appear (a list repeated n times in a list counts n times),
+    counting stops once the size is over MAX_SEQUENCE_LENGTH
+    '''
+    size = 0
+    stack = [value]
+    while stack and size <= MAX_SEQUENCE_LENGTH:
+        item = stack.pop()
+        if isinstance(item, (str, bytes)):
+            size += max(len(item), 1)
+        elif isinstance(item, bool) or item is None:
+            size += 1
+        elif isinstance(item, int):
+            size += 1 + item.bit_length() // 3
+        elif isinstance(item, float):
+            size += 24
+        elif isinstance(item, dict):
+            size += 1
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            size += 1
+            stack.extend(item)
+        else:
+            size += 1
+    return size
+
+
+def _check_size(value):
+    if _size(value) > MAX_SEQUENCE_LENGTH:
+        raise ExpressionError("value too large")
+    return value
+
+
+def _check_length(text):
+    if len(text) > MAX_SEQUENCE_LENGTH:
+        raise ExpressionError("string too long")
+    return text
+
+
+def to_str(value):
+    '''
+    str() with the size limits of expressions - also used to render prompt placeholders
+    '''
+    return _check_length(str(_check_size(value)))
+
+
+def _multiply(left, right):
+    for sequence, count in ((left, right), (right, left)):
+        if isinstance(sequence, (str, list, tuple)) and isinstance(count, int):
+            if _size(sequence) * count > MAX_SEQUENCE_LENGTH:
+                raise ExpressionError("sequence too long")
+    return left * right
+
+
+def _add(left, right):
+    if isinstance(left, (str, list, tuple)) and isinstance(right, (str, list, tuple)):
+        if _size(left) + _size(right) > MAX_SEQUENCE_LENGTH:
+            raise ExpressionError("sequence too long")
+    return left + right
+
+
+def _power(left, right):
+    if isinstance(right, (int, float)) and abs(right) > MAX_EXPONENT:
+        raise ExpressionError("exponent too large")
+    if isinstance(left, int) and isinstance(right, int) and right > 0 and left.bit_length() * right > MAX_INT_BITS:
+        raise ExpressionError("result too large")
+    return left ** right
+
+
+def _check_widths(numbers):
+    for number in numbers:
+        if number == "*":
+            raise ExpressionError("* width not allowed")
+        if number and int(number) > MAX_SEQUENCE_LENGTH:
+            raise ExpressionError("format width too large")
+
+
+def _modulo(left, right):
+    if isinstance(left, str):
+        for width, precision in PERCENT_SPEC.findall(left):
+            _check_widths((width, precision))
+        _check_size(right)
+        return _check_length(left % right)
+    return left % right
+
+
+def _format(value, spec):
+    _check_widths(re.findall(r"\d+", spec))
+    return _check_length(format(_check_size(value), spec))
+
+
+def _sum(values, start):
+    if not isinstance(start, (int, float)):
+        raise ExpressionError("sum start must be a number")
+    return sum(values, start)
+
+
+def _replace(text, old, new, count=-1):
+    occurrences = text.count(old) if old else len(text) + 1
+    if 0 <= count < occurrences:
+        occurrences = count
+    if len(text) + occurrences * (len(new) - len(old)) > MAX_SEQUENCE_LENGTH:
+        raise ExpressionError("string too long")
+    return text.replace(old, new, count)
+
+
+def _join(separator, items):
+    items = list(items)
+    length = len(separator) * max(len(items) - 1, 0) + sum(len(item) for item in items if isinstance(item, str))
+    if length > MAX_SEQUENCE_LENGTH:
+        raise ExpressionError("string too long")
+    return separator.join(items)
+
+
+# methods that can build large values, with their size checks
+CHECKED_METHODS = {"replace": _replace, "join": _join}
+
+
+def _method(value, name):
+    for value_type, names in METHODS.items():
+        if isinstance(value, value_type) and name in names:
+            if value_type is str and name in CHECKED_METHODS:
+                checked = CHECKED_METHODS[name]
+                return lambda *args, **kwargs: checked(value, *args, **kwargs)
+            return getattr(value, name)
+    raise ExpressionError(f"method not allowed: {type(value).__name__}.{name}")
+
+
+def _compile(node):
+    '''
+    returns a function(context) -> value for an ast node
+    '''
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda context: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+
+        def load(context):
+            try:
+                return context[name]
+            except KeyError:
+                raise NameError(f"name '{name}' is not defined") from None
+        return load
+
+    if isinstance(node, ast.Subscript):
+        value, key = _compile(node.value), _compile(node.slice)
+        return lambda context: value(context)[key(context)]
+
+    if isinstance(node, ast.Slice):
+        parts = [_compile(part) if part is not None else None for part in (node.lower, node.upper, node.step)]
+        return lambda context: slice(*[part(context) if part is not None else None for part in parts])
+
+    if isinstance(node, ast.Attribute):
+        if node.attr.startswith("_"):
+            raise ExpressionError(f"private attribute not allowed: {node.attr}")
+        value, attribute = _compile(node.value), node.attr
+        return lambda context: getattr(value(context), attribute)
+
+    if isinstance(node, ast.Call):
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+            raise ExpressionError("*args / **kwargs not allowed")
+        args = [_compile(arg) for arg in node.args]
+        kwargs = [(kw.arg, _compile(kw.value)) for kw in node.keywords]
+        if isinstance(node.func, ast.Name):
+            if node.func.id not in FUNCTIONS:
+                raise ExpressionError(f"function not allowed: {node.func.id}")
+            function = FUNCTIONS[node.func.id]
+            return lambda context: function(*[arg(context) for arg in args], **{name: value(context) for name, value in kwargs})
+        if isinstance(node.func, ast.Attribute) and not node.func.attr.startswith("_"):
+            value, name = _compile(node.func.value), node.func.attr
+            return lambda context: _method(value(context), name)(*[arg(context) for arg in args], **{key: kwarg(context) for key, kwarg in kwargs})
+        raise ExpressionError("only whitelisted functions and methods can be called")
+
+    if isinstance(node, ast.BinOp):
+        if isinstance(node.op, ast.Mult):
+            function = _multiply
+        elif isinstance(node.op, ast.Add):
+            function = _add
+        elif isinstance(node.op, ast.Pow):
+            function = _power
+        elif isinstance(node.op, ast.Mod):
+            function = _modulo
+        elif type(node.op) in BINARY_OPERATORS:
+            function = BINARY_OPERATORS[type(node.op)]
+        else:
+            raise ExpressionError(f"operator not allowed: {type(node.op).__name__}")
+        left, right = _compile(node.left), _compile(node.right)
+        return lambda context: function(left(context), right(context))
+
+    if isinstance(node, ast.UnaryOp):
+        if type(node.op) not in UNARY_OPERATORS:
+            raise ExpressionError(f"operator not allowed: {type(node.op).__name__}")
+        function, operand = UNARY_OPERATORS[type(node.op)], _compile(node.operand)
+        return lambda context: function(operand(context))
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            def evaluate_and(context):
+                result = True
+                for value in values:
+                    result = value(context)
+                    if not result:
+                        return result
+                return result
+            return evaluate_and
+
+        def evaluate_or(context):
+            result = False
+            for value in values:
+                result = value(context)
+                if result:
+                    return result
+            return result
+        return evaluate_or
+
+    if isinstance(node, ast.Compare):
+        left = _compile(node.left)
+        comparisons = [(COMPARE_OPERATORS[type(op)], _compile(comparator)) for op, comparator in zip(node.ops, node.comparators)]
+
+        def compare(context):
+            current = left(context)
+            for function, comparator in comparisons:
+                right = comparator(context)
+                if not function(current, right):
+                    return False
+                current = right
+            return True
+        return compare
+
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = _compile(node.test), _compile(node.body), _compile(node.orelse)
+        return lambda context: body(context) if test(context) else orelse(context)
+
+    if isinstance(node, ast.Dict):
+        if any(key is None for key in node.keys):
+            raise ExpressionError("** in dict literals not allowed")
+        items = [(_compile(key), _compile(value)) for key, value in zip(node.keys, node.values)]
+        return lambda context: _check_size({key(context): value(context) for key, value in items})
+
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        if any(isinstance(element, ast.Starred) for element in node.elts):
+            raise ExpressionError("* in literals not allowed")
+        elements = [_compile(element) for element in node.elts]
+        container = {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)]
+        return lambda context: _check_size(container([element(context) for element in elements]))
+
+    if isinstance(node, ast.JoinedStr):
+        parts = [_compile(value) for value in node.values]
+        return lambda context: _check_length("".join([to_str(part(context)) for part in parts]))
+
+    if isinstance(node, ast.FormattedValue):
+        value = _compile(node.value)
+        conversion = {-1: None, 115: str, 114: repr, 97: ascii}[node.conversion]
+        if conversion is not None:
+            convert = conversion
+            conversion = lambda value: _check_length(convert(_check_size(value)))
+        format_spec = _compile(node.format_spec) if node.format_spec is not None else None
+
+        def formatted(context):
+            result = value(context)
+            if conversion is not None:
+                result = conversion(result)
+            return _format(result, format_spec(context) if format_spec is not None else "")
+        return formatted
+
+    raise ExpressionError(f"syntax not allowed: {type(node).__name__}")
+
+
+def _names(tree):
+    '''
+    the context names an expression reads (called function names excluded)
+    '''
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    return frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in functions)
+
+
+def compile_expression(expression):
+    '''
+    parse and compile an expression once, returns a function(context: dict) -> value
+    the function's names attribute is the set of context names it reads - empty for constant expressions
+    raises SyntaxError for invalid python and ExpressionError for syntax that isn't allowed
+    '''
+    tree = ast.parse(expression.strip(), '<string>', mode='eval')
+    evaluate = _compile(tree.body)
+    evaluate.names = _names(tree)
+    return evaluate
@@ -7,22 +7,40 @@ the types of the steps are defined here.
 Each step type has a corresponding function that handles it.
 
 Validation:
-A step is a dictionary.
+A step is a dictionary (or a read-only mapping for built steps).
 the step has to have the necessary fields according to the step type.
 
+Built steps (StepHandler.build) are built once per task and don't capture
+task_input/memory - the handlers get them at execution time.
+Steps returned by a custom task function (see tamplates/task_tamplate.py)
+can use closures instead (update_memory_func / input_data_func / messages).
+
 mandatory fields:
 - type: str - the type of the step 
 
+optional fields (parallel steps):
+- id: str - the name of the step, for dependsOn
+- dependsOn: list of ids of earlier steps. when a task declares dependsOn, its steps run
+  as soon as their dependencies finished (independent steps in parallel). the step's
+  last_step_result is the result of its dependency, or a dict {id: result} of several.
+  a step without dependsOn depends on the previous step.
+  built steps get id and depends_on (indices), custom steps can set them directly.
+
+constant step (made by the workflow optimizer from pure tool calls with constant inputs):
+- value: any - the result of the step
+
 update_memory step:
-- update_memory_func: function that updates the memory
+- update_memory_func: function that updates the memory (custom steps)
 - memory_arg: any
 
 tool step:
 - tool: str - the name of the tool
-- input_data_func: function that returns the input data for the tool
+- input_expression: compiled expression that returns the input data for the tool (built steps)
+- input_data_func: function that returns the input data for the tool (custom steps)
 
 llm_interact step:
-- messages: function that returns the messages for the llm 
+- template: CompiledTemplate - the prompt template (built steps)
+- messages: function that returns the messages for the llm (custom steps)
     --  arguments:
         - last_step_result: str - the result of the last step 
           each step executed one after the other, 
@@ -30,25 +48,49 @@ llm_interact step:
           **if the step is the first one, use the task function's argument - task_input instead**
 - model: str - the model to use for the llm 
 (default is "gpt-4o-mini", defined in the handle_llm_interact)
+- cache: bool - false to bypass the llm response cache for this step (default true)
+- stable_prefix: bool - render the template prefix-stable (static text first, values last,
+  see CompiledTemplate.render_stable) so the provider's prompt cache can reuse the prompt prefix
+- use_tools: bool - function calling: the agent's tools are sent to the model, its tool calls
+  run (concurrently) and their results are sent back until it answers without tool calls
+- max_tool_iterations: int - max model turns with tool calls (default 5), then it has to answer
 
 '''
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-import ast
+from types import MappingProxyType
+import asyncio
+import contextvars
+import json
 import re
 
+from buildingBlocks.tracing import tracer
+from factories.expressions import compile_expression, to_str
+
 class StepType(Enum):
     UPDATE_MEMORY = "update_memory"
     TOOL = "tool"
     LLM_INTERACT = "llm_interact"
+    CONSTANT = "constant"
 
 class StepHandler:
     def __init__(self):
 
         # Dictionary mapping step types to their corresponding functions
         self.step_handlers = {
-            StepType.UPDATE_MEMORY.value: lambda agent_instance, step, response: handle_update_memory(agent_instance, step, response),
-            StepType.TOOL.value: lambda agent_instance, step, response: handle_tool(agent_instance, step, response),
-            StepType.LLM_INTERACT.value: lambda agent_instance, step, response: handle_llm_interact(agent_instance, step, response),
+            StepType.UPDATE_MEMORY.value: handle_update_memory,
+            StepType.TOOL.value: handle_tool,
+            StepType.LLM_INTERACT.value: handle_llm_interact,
+            StepType.CONSTANT.value: handle_constant,
+        }
+
+        # async counterparts used by Agent.aexecute
+        self.async_step_handlers = {
+            StepType.UPDATE_MEMORY.value: ahandle_update_memory,
+            StepType.TOOL.value: ahandle_tool,
+            StepType.LLM_INTERACT.value: ahandle_llm_interact,
+            StepType.CONSTANT.value: ahandle_constant,
         }
         
         self.step_builders = {
@@ -61,35 +103,197 @@ class StepHandler:
     def get(self, step_type):
         return self.step_handlers.get(step_type)
 
-    def build(self, step, task_input, memory):
-        return self.step_builders.get(step["type"])(step=step, task_input=task_input, memory=memory)
+    def aget(self, step_type):
+        return self.async_step_handlers.get(step_type)
+
+    def build(self, step, step_id=None, depends_on=None):
+        '''
+        build an immutable step from a step spec (once, at build time)
+        depends_on: tuple of the indices of the steps it waits for (see resolve_dependencies)
+        '''
+        fields = self.step_builders.get(step["type"])(step=step)
+        if depends_on is not None:
+            fields["id"] = step_id
+            fields["depends_on"] = depends_on
+        return MappingProxyType(fields)
 
 
 # steps handling functions
 
-def handle_llm_interact(agent_instance, step, response):
+def build_llm_messages(agent_instance, step, response, task_input=None, memory=None):
     messages = [
         {"role": "system", "content": agent_instance.role},
     ]
-    try:
-        step_messages = step["messages"](response)
-    except Exception as e:
-        print(f"error in step messages function: {e}")
+    if "template" in step:
+        # Define the context available to the prompt
+        context = {
+            "memory": memory,
+            "task_input": task_input,
+            "last_step_result": response,
+        }
+        template = step["template"]
+        content = template.render_stable(context) if step.get("stable_prefix") else template.render(context)
+        step_messages = [
+            {"role": "user", "content": content},
+        ]
+    else:
+        try:
+            step_messages = step["messages"](response)
+        except Exception as e:
+            print(f"error in step messages function: {e}")
 
     messages.extend(step_messages)
+    return messages
 
-    response = agent_instance.interact_func(
-        llm_client=agent_instance.llm_client,
-        messages=messages, 
-        model=step.get("model", "gpt-4o-mini"))
+def interact_kwargs(step, on_token=None):
+    # only pass what is actually set, so plain interact functions keep working
+    kwargs = {} if step.get("cache", True) else {"use_cache": False}
+    if on_token is not None:
+        kwargs["on_token"] = on_token
+    return kwargs
+
+def handle_llm_interact(agent_instance, step, response, task_input=None, memory=None):
+    messages = build_llm_messages(agent_instance, step, response, task_input, memory)
+
+    model = step.get("model", "gpt-4o-mini")
+    if step.get("use_tools"):
+        return handle_llm_tools(agent_instance, step, messages, model)
+    with tracer.span("llm", model):
+        response = agent_instance.interact_func(
+            llm_client=agent_instance.llm_client,
+            messages=messages, 
+            model=model,
+            **interact_kwargs(step))
     
     return response
     
-def handle_tool(agent_instance, step, response):
-    return agent_instance.tools[step["tool"]][0](**step["input_data_func"](response))
+def handle_tool(agent_instance, step, response, task_input=None, memory=None):
+    if "input_expression" in step:
+        input_data = step["input_expression"]({'last_step_result': response, 'task_input': task_input, 'memory': memory})
+    else:
+        input_data = step["input_data_func"](response)
+    with tracer.span("tool", step["tool"]):
+        return agent_instance.tools[step["tool"]][0](**input_data)
+
+def handle_constant(agent_instance, step, response, task_input=None, memory=None):
+    return step["value"]
+
+def tool_message(call, result):
+    content = result if isinstance(result, str) else json.dumps(result, default=str)
+    return {"role": "tool", "tool_call_id": call["id"], "content": content}
+
+def call_tool(agent_instance, call):
+    '''
+    run a single tool call of the model - errors are returned to the model as the tool's result
+    '''
+    name = call["function"]["name"]
+    with tracer.span("tool", name):
+        try:
+            if name not in agent_instance.tools:
+                raise ValueError(f"unknown tool: {name}")
+            arguments = json.loads(call["function"]["arguments"] or "{}")
+            result = agent_instance.tools[name][0](**arguments)
+        except Exception as e:
+            result = f"Error: {e}"
+    return tool_message(call, result)
+
+def call_tools(agent_instance, calls):
+    '''
+    the tool calls of one model turn run concurrently, returns the tool messages in the order of the calls
+    '''
+    if len(calls) == 1:
+        return [call_tool(agent_instance, calls[0])]
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        # copy the context so the tool spans get the right parent
+        futures = [executor.submit(contextvars.copy_context().run, call_tool, agent_instance, call) for call in calls]
+        return [future.result() for future in futures]
+
+def handle_llm_tools(agent_instance, step, messages, model):
+    '''
+    function calling loop, returns the model's final answer
+    '''
+    if agent_instance.tools_interact_func is None:
+        raise ValueError(f"agent {agent_instance.name} has no tools_interact_func for use_tools")
+    tools = agent_instance.tool_schemas()
+    for iteration in range(step.get("max_tool_iterations", 5)):
+        with tracer.span("llm", model, iteration=iteration):
+            message = agent_instance.tools_interact_func(
+                llm_client=agent_instance.llm_client, messages=messages, model=model, tools=tools)
+        if not message.get("tool_calls"):
+            return message.get("content")
+        messages.append(message)
+        messages.extend(call_tools(agent_instance, message["tool_calls"]))
+    # too many tool turns - the model has to answer with what it has
+    with tracer.span("llm", model, iteration=step.get("max_tool_iterations", 5)):
+        message = agent_instance.tools_interact_func(
+            llm_client=agent_instance.llm_client, messages=messages, model=model, tools=tools, tool_choice="none")
+    return message.get("content")
 
-def handle_update_memory(agent_instance, step, response):
-    return step["update_memory_func"](response, step["memory_arg"])
+def handle_update_memory(agent_instance, step, response, task_input=None, memory=None):
+    if "update_memory_func" in step:
+        return step["update_memory_func"](response, step["memory_arg"])
+    memory[step["memory_arg"]] = response
+    return response
+
+
+# async steps handling functions
+
+async def ahandle_llm_interact(agent_instance, step, response, task_input=None, memory=None, on_token=None):
+    '''
+    on_token: function(token: str) - if given, the response is streamed token by token
+    (with use_tools the final answer arrives as a single token)
+    '''
+    if step.get("use_tools") and agent_instance.atools_interact_func is not None:
+        messages = build_llm_messages(agent_instance, step, response, task_input, memory)
+        content = await ahandle_llm_tools(agent_instance, step, messages, step.get("model", "gpt-4o-mini"))
+        if on_token is not None and content:
+            on_token(content)
+        return content
+    if agent_instance.ainteract_func is None or step.get("use_tools"):
+        # no async interact function - keep the blocking call off the event loop
+        return await asyncio.to_thread(handle_llm_interact, agent_instance, step, response, task_input, memory)
+
+    messages = build_llm_messages(agent_instance, step, response, task_input, memory)
+
+    model = step.get("model", "gpt-4o-mini")
+    with tracer.span("llm", model):
+        response = await agent_instance.ainteract_func(
+            llm_client=agent_instance.async_llm_client,
+            messages=messages,
+            model=model,
+            **interact_kwargs(step, on_token))
+
+    return response
+
+async def ahandle_tool(agent_instance, step, response, task_input=None, memory=None, on_token=None):
+    # tools are plain (blocking) python functions
+    return await asyncio.to_thread(handle_tool, agent_instance, step, response, task_input, memory)
+
+async def ahandle_llm_tools(agent_instance, step, messages, model):
+    '''
+    async version of handle_llm_tools - the tool calls of a turn run concurrently in worker threads
+    '''
+    tools = agent_instance.tool_schemas()
+    for iteration in range(step.get("max_tool_iterations", 5)):
+        with tracer.span("llm", model, iteration=iteration):
+            message = await agent_instance.atools_interact_func(
+                llm_client=agent_instance.async_llm_client, messages=messages, model=model, tools=tools)
+        if not message.get("tool_calls"):
+            return message.get("content")
+        messages.append(message)
+        messages.extend(await asyncio.gather(*[
+            asyncio.to_thread(call_tool, agent_instance, call) for call in message["tool_calls"]
+        ]))
+    with tracer.span("llm", model, iteration=step.get("max_tool_iterations", 5)):
+        message = await agent_instance.atools_interact_func(
+            llm_client=agent_instance.async_llm_client, messages=messages, model=model, tools=tools, tool_choice="none")
+    return message.get("content")
+
+async def ahandle_constant(agent_instance, step, response, task_input=None, memory=None, on_token=None):
+    return step["value"]
+
+async def ahandle_update_memory(agent_instance, step, response, task_input=None, memory=None, on_token=None):
+    return handle_update_memory(agent_instance, step, response, task_input, memory)
 
 
 def validate(function):
@@ -100,7 +304,7 @@ def validate(function):
             raise Exception("function should be a function")
         
         steps = function(None, None)
-        if not isinstance(steps, list):
+        if not isinstance(steps, (list, tuple)):
             raise Exception("function should return a list of steps")
         for step in steps:
             validateSteps(step)
@@ -111,81 +315,178 @@ def validateSteps(step) -> bool:
         check the structure of the step
         if is not valid - raise an exception
         '''
-        if not isinstance(step, dict):
+        if not isinstance(step, Mapping):
             raise Exception("step should be a dictionary")
         if "type" not in step:
             raise Exception("step should have a type")
         if step["type"] == StepType.LLM_INTERACT.value:
-            if "messages" not in step:
+            if "messages" not in step and "template" not in step:
                 raise Exception("llm_interact step should have a messages function")
         elif step["type"] == StepType.TOOL.value:
             if "tool" not in step:
                 raise Exception("tool step should have a tool name")
-            if "input_data_func" not in step:
+            if "input_data_func" not in step and "input_expression" not in step:
                 raise Exception("tool step should have an input_data_func function")
         elif step["type"] == StepType.UPDATE_MEMORY.value:
-            if "update_memory_func" not in step:
-                raise Exception("update_memory step should have an update_memory_func function")
             if "memory_arg" not in step:
                 raise Exception("update_memory step should have a memory_arg")
+        elif step["type"] == StepType.CONSTANT.value:
+            if "value" not in step:
+                raise Exception("constant step should have a value")
         else:
             raise Exception(f"step type not recognized: {step['type']}")
         return True
 
-# builders
-def build_llm_interact(step, task_input, memory):
-    promptTemplate = step["promptTemplate"]
-    model = step.get("model", "gpt-4o-mini")
+def resolve_dependencies(steps_specs):
+    '''
+    the dependencies of the steps (dependsOn: ids of earlier steps) as tuples of step indices,
+    None if no step declares dependsOn - the steps run one after the other.
+    a step without dependsOn depends on the previous step, dependsOn: [] - on no step
+    '''
+    if all(spec.get("dependsOn") is None for spec in steps_specs):
+        return None
+    indices = {}
+    dependencies = []
+    for index, spec in enumerate(steps_specs):
+        if spec.get("dependsOn") is None:
+            dependencies.append((index - 1,) if index else ())
+        else:
+            for step_id in spec["dependsOn"]:
+                if step_id not in indices:
+                    raise ValueError(f"step {spec.get('id') or index} depends on an unknown or later step: {step_id}")
+            dependencies.append(tuple(dict.fromkeys(indices[step_id] for step_id in spec["dependsOn"])))
+        step_id = spec.get("id")
+        if step_id is not None:
+            if step_id in indices:
+                raise ValueError(f"duplicate step id: {step_id}")
+            indices[step_id] = index
+    return dependencies
 
-    def evaluate_placeholders(template, **context):
-        """
-        Dynamically evaluate placeholders in the template using the provided context.
-        Supports nested keys like {memory['key']}.
-        """
-        def replacer(match):
-            expression = match.group(1)
-            try:
-                # Evaluate the expression within the context
-                return str(eval(expression, {}, context))
-            except Exception as e:
-                return f"<Error: {e}>"
-
-        # Match anything inside {curly_braces}
-        return re.sub(r"{(.*?)}", replacer, template)
-
-    def messages_func(last_step_result):
-        # Define the context available to the prompt
-        context = {
-            "memory": memory,
-            "task_input": task_input,
-            "last_step_result": last_step_result,
-        }
+# templates
+class CompiledTemplate:
+    '''
+    prompt template parsed once into literal segments and placeholders.
+    a placeholder is anything inside {curly_braces}, supports nested keys like {memory['key']}.
+    placeholders are safe expressions (see factories/expressions.py) compiled once,
+    rendering is a single join - no regex and no re-parsing.
+    constant placeholders ({1 + 1}) are rendered once here and merged into the literal text
+    names: the context names the placeholders read
+    skeleton / placeholders: the template with every placeholder replaced by a <label> reference,
+    and the (label, placeholder) pairs - see render_stable
+    '''
+    __slots__ = ("template", "segments", "names", "skeleton", "placeholders")
 
-        # Process the prompt template
-        formatted_prompt = evaluate_placeholders(promptTemplate, **context)
+    def __init__(self, template):
+        self.template = template
+        segments = []
+        names = set()
+        skeleton = []
+        labels = {}  # expression -> label
+        placeholders = []
+        # re.split with a group alternates literal text and placeholder expressions
+        for index, part in enumerate(re.split(r"{(.*?)}", template)):
+            if index % 2 == 1:
+                placeholder = compile_placeholder(part)
+                if placeholder.names:
+                    names |= placeholder.names
+                    segments.append(placeholder)
+                    expression = part.strip()
+                    if expression not in labels:
+                        labels[expression] = placeholder_label(expression, labels.values())
+                        placeholders.append((labels[expression], placeholder))
+                    skeleton.append(f"<{labels[expression]}>")
+                    continue
+                part = placeholder({})
+            if not part:
+                continue
+            skeleton.append(part)
+            if segments and type(segments[-1]) is str:
+                segments[-1] += part
+            else:
+                segments.append(part)
+        self.segments = tuple(segments)
+        self.names = frozenset(names)
+        # already prefix-stable: no placeholder, or a single one at the very end
+        stable = not placeholders or (len(segments) <= 2 and type(segments[-1]) is not str)
+        self.skeleton = None if stable else "".join(skeleton)
+        self.placeholders = tuple(placeholders)
 
-        messages = [
-            {"role": "user", "content": formatted_prompt},
-        ]
-        return messages
+    def render(self, context):
+        return "".join([segment if type(segment) is str else segment(context) for segment in self.segments])
 
-    return {"type": StepType.LLM_INTERACT.value, "messages": messages_func, "model": model}
+    def render_stable(self, context):
+        '''
+        prefix-stable rendering for provider prompt caching: the static text of the template first
+        (placeholders as <label> references), the dynamic values last as <label>...</label> blocks.
+        the prompt starts the same way on every call, whatever the values are
+        '''
+        if self.skeleton is None:
+            return self.render(context)
+        blocks = [f"<{label}>\n{placeholder(context)}\n</{label}>" for label, placeholder in self.placeholders]
+        return self.skeleton + "\n\n" + "\n".join(blocks)
 
 
-def build_tool(step, task_input, memory):
-    tool_name = step["tool"]
-    input_data_func_expression = step["input_data_func"]
-    tree = ast.parse(input_data_func_expression, mode='eval')
-    # need to implement a safe eval
-    code = compile(tree, '<string>', 'eval')
-    return {"type" : StepType.TOOL.value, "tool": tool_name, "input_data_func": lambda last_step_result: eval(code, {'last_step_result': last_step_result, 'task_input' : task_input, 'memory': memory})}
+def placeholder_label(expression, used):
+    '''
+    a readable label for a placeholder - its last name or key: memory['user_input'] -> user_input
+    '''
+    words = re.findall(r"[A-Za-z_][A-Za-z0-9_]*", expression)
+    base = words[-1] if words else "value"
+    label, count = base, 1
+    while label in used:
+        count += 1
+        label = f"{base}_{count}"
+    return label
 
-def build_update_memory(step, task_input, memory):
-    # memory, memory_arg_input
-    memory_arg_input = step["memory_arg"]
-    
-    def update_memory_func(last_step_result, memory_arg):
-        memory[memory_arg] = last_step_result
-        return last_step_result
-    
-    return {"type" : StepType.UPDATE_MEMORY.value, "update_memory_func": update_memory_func, "memory_arg": memory_arg_input}
+
+def compile_template(template):
+    return CompiledTemplate(template)
+
+
+def compile_placeholder(expression):
+    '''
+    returns a function(context) -> str for a single placeholder
+    errors (invalid or not allowed expressions, failed lookups) are rendered as <Error: ...> in the prompt
+    '''
+    try:
+        evaluate = compile_expression(expression)
+    except (SyntaxError, ValueError) as e:
+        error = f"<Error: {e}>"
+        render_error = lambda context: error
+        render_error.names = frozenset()
+        return render_error
+
+    def render(context):
+        try:
+            return to_str(evaluate(context))
+        except Exception as e:
+            return f"<Error: {e}>"
+
+    render.names = evaluate.names
+    return render
+
+
+# builders
+# a builder gets the step spec and returns the fields of the built step.
+# built steps don't capture task_input/memory - they are passed to the handlers at execution time
+def build_llm_interact(step):
+    fields = {
+        "type": StepType.LLM_INTERACT.value,
+        "template": compile_template(step["promptTemplate"]),
+        "model": step.get("model") or "gpt-4o-mini",
+        "cache": step.get("cache") is not False,
+    }
+    if step.get("stablePrefix"):
+        fields["stable_prefix"] = True
+    if step.get("useTools"):
+        fields["use_tools"] = True
+        fields["max_tool_iterations"] = step.get("maxToolIterations") or 5
+    return fields
+
+
+def build_tool(step):
+    return {"type": StepType.TOOL.value, "tool": step["tool"], "input_expression": compile_expression(step["input_data_func"])}
+
+
+def build_update_memory(step):
+    return {"type": StepType.UPDATE_MEMORY.value, "memory_arg": step["memory_arg"]}
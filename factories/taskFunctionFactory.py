@@ -1,5 +1,19 @@
+from factories.stepHandlers import StepHandler, resolve_dependencies, validateSteps
 
-from factories.stepHandlers import StepHandler, validate
+
+class TaskPlan:
+    '''
+    compiled task function - the steps are built once and are immutable.
+    task_input and memory are passed to the step handlers at execution time,
+    calling the plan just returns its steps, so it can be used as a task function
+    '''
+    __slots__ = ("steps",)
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    def __call__(self, task_input, memory):
+        return self.steps
 
 
 class TaskFunctionFactory:
@@ -17,6 +31,8 @@ class TaskFunctionFactory:
         each step contains:
         - type: str - the type of the step
         - other fields that are specific to the type
+        - id, dependsOn (optional) - see factories/stepHandlers.py
+        returns a TaskPlan
         '''
         try:
             for step_spec in steps_specs:
@@ -24,17 +40,18 @@ class TaskFunctionFactory:
                     raise Exception("step should be a dictionary")
                 if "type" not in step_spec:
                     raise Exception("step should have a type field")
-                
-            
-            def func(task_input, memory):
-                steps = []
-                for step in steps_specs:
-                    steps.append(self.stepHandler.build(step, task_input, memory))
-                    
-                return steps
-            
-            validate(func)
-            return func
+
+            dependencies = resolve_dependencies(steps_specs)
+            if dependencies is None:
+                steps = [self.stepHandler.build(step_spec) for step_spec in steps_specs]
+            else:
+                steps = [
+                    self.stepHandler.build(step_spec, step_spec.get("id") or str(index), dependencies[index])
+                    for index, step_spec in enumerate(steps_specs)
+                ]
+            for step in steps:
+                validateSteps(step)
+            return TaskPlan(steps)
         except Exception as e:
             raise e
 
@@ -46,6 +63,4 @@ class TaskFunctionFactory:
 #     {"type" : "update_memory", "memory_arg" : "key"}
 # ]
 # taskFunction = taskFunctionFact.createTaskFunction(steps_specs)
-# memory = {}
-# print(taskFunction("input", memory)[2]['update_memory_func']("response", "key"))
-# print(memory)
\ No newline at end of file
+# print(taskFunction.steps)
\ No newline at end of file
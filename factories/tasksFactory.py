@@ -1,5 +1,6 @@
 from buildingBlocks.task import Task
 from factories.stepHandlers import validate
+from factories.taskFunctionFactory import TaskPlan
 
 class TaskFactory:
     '''
@@ -11,7 +12,9 @@ class TaskFactory:
         function: function
         model: str
         '''
-        validate(function)
+        if not isinstance(function, TaskPlan):
+            # task plans are validated when they are built
+            validate(function)
         return Task(
             agent=agent, 
             function=function
@@ -0,0 +1,116 @@
+'''
+memoization of pure tools
+
+a pure tool returns the same result for the same arguments and has no side effects
+(e.g. a calculator, a lookup in static data). its results are cached by a canonical
+hash of the arguments, so repeated calls - in any session of the workflow - don't run it again.
+
+arguments are canonicalized as json with sorted keys (sets are sorted, bytes are hex encoded).
+calls with arguments that can't be canonicalized (arbitrary objects) are not cached.
+cached results are shared between callers - a pure tool shouldn't return objects that are mutated later.
+
+usage:
+    cache = ToolCache(max_size=1024, ttl=3600)
+    cached_add = cache.wrap(add)
+    cached_add(x=1, y=2)  # runs add
+    cached_add(y=2, x=1)  # cache hit
+'''
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+from buildingBlocks.tracing import tracer
+
+
+def _canonical(value):
+    if isinstance(value, (set, frozenset)):
+        # json encodes the items (default handles nested sets / bytes), sorted by their encoding
+        return sorted(value, key=lambda item: json.dumps(item, sort_keys=True, default=_canonical))
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": bytes(value).hex()}
+    raise TypeError(f"can't canonicalize {type(value).__name__}")
+
+
+def arguments_key(kwargs):
+    '''
+    canonical hash of the tool arguments, None if they can't be canonicalized
+    '''
+    try:
+        payload = json.dumps(kwargs, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_canonical)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ToolCache:
+    '''
+    bounded cache of a single tool's results
+    max_size: int - max number of entries, the least recently used are evicted
+    ttl: float - seconds an entry is valid (None - no expiry)
+    '''
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, result)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def get(self, key):
+        '''
+        returns (found, result) - a tool result can be None
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at is None or expires_at >= time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, result):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires_at, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def wrap(self, tool_function):
+        def cached_tool(**kwargs):
+            key = arguments_key(kwargs)
+            if key is None:
+                with self.lock:
+                    self.uncacheable += 1
+                return tool_function(**kwargs)
+            found, result = self.get(key)
+            tracer.record(cache_hit=found)
+            if not found:
+                result = tool_function(**kwargs)
+                self.set(key, result)
+            return result
+        cached_tool.tool_cache = self
+        return cached_tool
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+        }
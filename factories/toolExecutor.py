@@ -0,0 +1,154 @@
+'''
+process pool backend for tools
+
+tools registered through ToolsFactory.addTool normally run in-process.
+with a ProcessToolExecutor the tool source is loaded once in every worker process
+(when the worker starts, or on the first call of a tool registered later).
+a tool that runs longer than its timeout fails, and its pool is replaced: the old pool takes no new calls,
+its other running calls finish, then its processes (and the stuck worker) are killed.
+so a hung tool can't hang the request forever, nor fail the calls running next to it.
+
+usage:
+    executor = ProcessToolExecutor(processes=4, default_timeout=30)
+    toolsFactory = ToolsFactory(executor=executor)
+    toolsFactory.addTool("calculator", func, {...}, timeout=5)
+'''
+import hashlib
+import multiprocessing
+import threading
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from factories.toolsFactory import load_tool_function
+
+
+# tools loaded in the current worker process: key -> function
+_worker_tools = {}
+
+
+def _init_worker(sources, memory_limit, cpu_limit):
+    if resource is not None:
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        if cpu_limit:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+    for key, source in sources.items():
+        _worker_tools[key] = load_tool_function(source)
+
+
+def _invoke(key, source, kwargs):
+    function = _worker_tools.get(key)
+    if function is None:
+        # registered after the worker started
+        function = _worker_tools[key] = load_tool_function(source)
+    return function(**kwargs)
+
+
+class ToolTimeoutError(TimeoutError):
+    pass
+
+
+class RemoteTool:
+    '''
+    callable that stands in for the tool function - the call runs in the executor
+    '''
+    __slots__ = ("executor", "key", "name", "timeout")
+
+    def __init__(self, executor, key, name, timeout):
+        self.executor = executor
+        self.key = key
+        self.name = name
+        self.timeout = timeout
+
+    def __call__(self, **kwargs):
+        return self.executor.invoke(self.key, kwargs, timeout=self.timeout, name=self.name)
+
+
+class ProcessToolExecutor:
+    '''
+    processes: int - number of worker processes (None - cpu count)
+    default_timeout: float - seconds, used by tools without their own timeout
+    memory_limit: int - address space limit of a worker in bytes (unix only)
+    cpu_limit: int - cpu seconds a worker may use before it is killed (unix only),
+               counts over the worker's lifetime - see max_tasks_per_worker
+    max_tasks_per_worker: int - a worker is replaced after this many calls
+    start_method: str - multiprocessing start method (None - platform default)
+    '''
+    def __init__(self, processes=None, default_timeout=30, memory_limit=None, cpu_limit=None,
+                 max_tasks_per_worker=100, start_method=None):
+        self.processes = processes
+        self.default_timeout = default_timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.context = multiprocessing.get_context(start_method)
+        self.sources = {}  # key -> source
+        self.pool = None
+        self.in_flight = {}  # pool -> calls waiting for it (including retired pools)
+        self.lock = threading.Lock()
+
+    def register(self, name, source, timeout=None):
+        '''
+        returns a RemoteTool for the source
+        the same source is shared between workflows (keyed by its hash)
+        '''
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        with self.lock:
+            # running workers load it on its first call
+            self.sources.setdefault(key, source)
+        return RemoteTool(self, key, name, timeout)
+
+    def warm_up(self):
+        with self.lock:
+            self._get_pool()
+
+    def invoke(self, key, kwargs, timeout=None, name=None):
+        timeout = timeout or self.default_timeout
+        with self.lock:
+            pool = self._get_pool()
+            self.in_flight[pool] = self.in_flight.get(pool, 0) + 1
+            source = self.sources[key]
+        try:
+            return pool.apply_async(_invoke, (key, source, kwargs)).get(timeout)
+        except multiprocessing.TimeoutError:
+            # the worker is stuck - new calls go to a new pool
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            raise ToolTimeoutError(f"tool {name or key} timed out after {timeout} seconds")
+        finally:
+            self._release(pool)
+
+    def _release(self, pool):
+        '''
+        a retired pool is killed once no call waits for it (its stuck workers die with it)
+        '''
+        with self.lock:
+            self.in_flight[pool] -= 1
+            if self.in_flight[pool] or pool is self.pool:
+                return
+            del self.in_flight[pool]
+        threading.Thread(target=pool.terminate, daemon=True).start()
+
+    def shutdown(self):
+        with self.lock:
+            pools = set(self.in_flight)
+            if self.pool is not None:
+                pools.add(self.pool)
+            self.pool = None
+            self.in_flight = {}
+        for pool in pools:
+            pool.terminate()
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = self.context.Pool(
+                processes=self.processes,
+                initializer=_init_worker,
+                initargs=(dict(self.sources), self.memory_limit, self.cpu_limit),
+                maxtasksperchild=self.max_tasks_per_worker
+            )
+        return self.pool
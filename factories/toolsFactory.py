@@ -1,39 +1,72 @@
 
 import ast
 
+from factories.toolCache import ToolCache
+
+
+def load_tool_function(tool_function_str):
+    # Parse and compile the function string
+    tree = ast.parse(tool_function_str, mode='exec')
+    code = compile(tree, '<string>', 'exec')
+    
+    # Create a namespace dictionary to execute the code in
+    namespace = {}
+    
+    # Execute the compiled code to define the function in the namespace
+    exec(code, namespace)
+    
+    # Get the function reference from the namespace
+    function_name = list(namespace.keys())[1]  # The first key is '__builtins__'
+
+    function_ref = namespace[function_name]
+    return function_ref
+
 
 class ToolsFactory:
-    def __init__(self):
+    '''
+    executor: ProcessToolExecutor (optional) - run the tools in worker processes
+              instead of in-process (see toolExecutor.py)
+    '''
+    def __init__(self, executor=None):
         self.tools = {}
+        self.executor = executor
 
     
-    def addTool(self, toolName, toolFunction, toolDescription):
+    def addTool(self, toolName, toolFunction, toolDescription, timeout=None, pure=False, cache_size=1024, cache_ttl=None):
+        '''
+        timeout: float - seconds, only used with an executor (default - the executor's default_timeout)
+        pure: bool - the tool is deterministic and has no side effects, its results are memoized
+              by the hash of the arguments (see toolCache.py)
+        cache_size: int - max memoized results, cache_ttl: float - seconds a result is valid (None - forever)
+        '''
         if toolName in self.tools:
             raise ValueError(f'Tool with name {toolName} already exists')
         
-        tool_function_code = self.parse(toolFunction)
+        if self.executor is not None:
+            # syntax errors are reported here, the code itself only runs in the workers
+            compile(ast.parse(toolFunction, mode='exec'), '<string>', 'exec')
+            tool_function_code = self.executor.register(toolName, toolFunction, timeout=timeout)
+        else:
+            tool_function_code = self.parse(toolFunction)
+        if pure:
+            tool_function_code = ToolCache(max_size=cache_size, ttl=cache_ttl).wrap(tool_function_code)
         
         self.tools[toolName] = [tool_function_code, toolDescription]
 
     def getTool(self, toolName):
         return self.tools[toolName]
+
+    def cacheStats(self):
+        '''
+        hit rates of the pure tools
+        '''
+        return {
+            tool_name: tool[0].tool_cache.stats()
+            for tool_name, tool in self.tools.items() if hasattr(tool[0], "tool_cache")
+        }
     
     def parse(self, tool_function_str):
-        # Parse and compile the function string
-        tree = ast.parse(tool_function_str, mode='exec')
-        code = compile(tree, '<string>', 'exec')
-        
-        # Create a namespace dictionary to execute the code in
-        namespace = {}
-        
-        # Execute the compiled code to define the function in the namespace
-        exec(code, namespace)
-        
-        # Get the function reference from the namespace
-        function_name = list(namespace.keys())[1]  # The first key is '__builtins__'
-
-        function_ref = namespace[function_name]
-        return function_ref
+        return load_tool_function(tool_function_str)
     
     
 
@@ -0,0 +1,144 @@
+'''
+build-time optimizer of compiled workflows
+
+runs once, after the flow graph is compiled (api.compile_workflow), and returns a report of what it changed:
+- folded_inputs: tool steps whose input is a constant expression ('{"x": 1, "y": 2}') -
+  the input is evaluated once instead of on every call
+- folded_tools: pure tool steps (see toolCache.py) with a constant input and no cache ttl - the tool runs once,
+  here, and the step becomes a constant step with its result. the call goes through the registered tool
+  function, so it runs in the tool executor (with its timeout and limits) when there is one.
+  results of a tool with a ttl expire, so those steps are left to the tool cache at run time
+- dropped_steps: constant / pure tool steps whose result nobody reads (the next step doesn't
+  use last_step_result) - they have no side effects, so they are removed
+- fused_chains: straight lines of tasks that run as a single unit (see FlowGraph.compile)
+
+a step that fails to fold (the expression or the tool raises) is kept as is - the error shows up at run time.
+tasks with dependsOn steps (parallel steps) are folded but no step is dropped.
+
+usage:
+    report = optimize_flow_graph(flowGraph)
+'''
+from types import MappingProxyType
+
+from buildingBlocks.flowGraph import ConditionNode
+from buildingBlocks.task import Task
+from factories.stepHandlers import StepType
+from factories.taskFunctionFactory import TaskPlan
+
+
+def _is_immutable(value):
+    if value is None or isinstance(value, (str, int, float, bool, bytes)):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return False
+
+
+def _constant_function(value):
+    constant = lambda context: value
+    constant.names = frozenset()
+    return constant
+
+
+def _reads_last_result(step):
+    '''
+    False only if the step surely doesn't use last_step_result (custom steps are assumed to use it)
+    '''
+    step_type = step["type"]
+    if step_type == StepType.CONSTANT.value:
+        return False
+    if step_type == StepType.LLM_INTERACT.value and "template" in step:
+        return "last_step_result" in step["template"].names
+    if step_type == StepType.TOOL.value and "input_expression" in step:
+        return "last_step_result" in step["input_expression"].names
+    return True
+
+
+def _is_pure(agent, step):
+    if step["type"] == StepType.CONSTANT.value:
+        return True
+    if step["type"] != StepType.TOOL.value or step["tool"] not in agent.tools:
+        return False
+    return hasattr(agent.tools[step["tool"]][0], "tool_cache")
+
+
+def _is_foldable(agent, step):
+    '''
+    a pure tool whose results don't expire
+    '''
+    return _is_pure(agent, step) and agent.tools[step["tool"]][0].tool_cache.ttl is None
+
+
+def _fold_step(agent, step, report, node_id, index):
+    '''
+    returns the folded step (or the step itself)
+    '''
+    if step["type"] != StepType.TOOL.value or "input_expression" not in step or step["input_expression"].names:
+        return step
+    if step["tool"] not in agent.tools:
+        return step
+    try:
+        input_data = step["input_expression"]({})
+    except Exception:
+        return step
+    if not isinstance(input_data, dict):
+        return step
+
+    fields = dict(step)
+    if _is_foldable(agent, step):
+        try:
+            fields["value"] = agent.tools[step["tool"]][0](**input_data)
+        except Exception:
+            return step
+        fields["type"] = StepType.CONSTANT.value
+        del fields["input_expression"]
+        report["folded_tools"].append({"node": node_id, "step": index, "tool": step["tool"]})
+        return MappingProxyType(fields)
+
+    # the dict is unpacked into the call - only its values are shared between calls
+    if not all(_is_immutable(value) for value in input_data.values()):
+        return step
+    fields["input_expression"] = _constant_function(input_data)
+    report["folded_inputs"].append({"node": node_id, "step": index, "tool": step["tool"]})
+    return MappingProxyType(fields)
+
+
+def optimize_task(task, node_id, report):
+    '''
+    fold and drop the steps of a task built from a TaskPlan (custom task functions are left as they are)
+    '''
+    if not isinstance(task.function, TaskPlan):
+        return
+    steps = [_fold_step(task.agent, step, report, node_id, index) for index, step in enumerate(task.function.steps)]
+
+    if not any("depends_on" in step for step in steps):
+        kept = []
+        for index, step in enumerate(steps):
+            is_last = index == len(steps) - 1
+            if not is_last and _is_pure(task.agent, step) and not _reads_last_result(steps[index + 1]):
+                report["dropped_steps"].append({"node": node_id, "step": index, "type": step["type"]})
+                continue
+            kept.append(step)
+        steps = kept
+
+    if any(new is not old for new, old in zip(steps, task.function.steps)) or len(steps) != len(task.function.steps):
+        task.function = TaskPlan(steps)
+
+
+def optimize_flow_graph(flow_graph):
+    '''
+    optimize the tasks of a flow graph (task nodes and classifier tasks of conditions), returns the report
+    '''
+    report = {"folded_inputs": [], "folded_tools": [], "dropped_steps": [], "fused_chains": []}
+    for node_id, node in flow_graph.nodes.items():
+        task = node.task if isinstance(node, ConditionNode) else node
+        if isinstance(task, Task):
+            optimize_task(task, node_id, report)
+
+    graph = flow_graph.compile()
+    fused = {follower for chain in graph.chains for follower in chain}
+    for index, chain in enumerate(graph.chains):
+        # report every chain once, from its head
+        if chain and index not in fused:
+            report["fused_chains"].append([graph.node_ids[member] for member in (index,) + chain])
+    return report
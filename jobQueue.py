@@ -0,0 +1,217 @@
+'''
+background jobs for long workflow runs
+
+a job is a coroutine function submitted to a bounded priority queue.
+a fixed pool of workers (asyncio tasks) runs the jobs - so the number of workflows running at once
+is sized separately from the number of http connections.
+- backpressure: submit raises QueueFullError when max_queued jobs are waiting
+- priority: higher priority runs first, same priority - first come first served
+- per-tenant quotas: a tenant never has more than its quota of jobs running,
+  its other jobs wait while jobs of other tenants run
+- finished jobs are kept for result_ttl seconds (at most max_finished of them)
+
+usage:
+    job_queue = JobQueue(workers=8, max_queued=1000, tenant_quotas={"free": 1}, default_quota=4)
+    job = job_queue.submit(lambda: conversationManager.arun("hello"), tenant="free", priority=0)
+    job_queue.get(job.job_id).status  # queued / running / completed / failed / cancelled
+'''
+from collections import OrderedDict
+import asyncio
+import heapq
+import itertools
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ("job_id", "func", "tenant", "priority", "status", "result", "error",
+                 "created", "started", "finished", "task")
+
+    def __init__(self, func, tenant, priority):
+        self.job_id = uuid.uuid4().hex
+        self.func = func
+        self.tenant = tenant
+        self.priority = priority
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "tenant": self.tenant,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    '''
+    workers: int - jobs running at the same time
+    max_queued: int - waiting jobs, submit raises QueueFullError above it
+    default_quota: int - max running jobs per tenant (None - only limited by workers)
+    tenant_quotas: dict - tenant -> max running jobs (overrides default_quota)
+    result_ttl: float - seconds a finished job is kept, max_finished: int - finished jobs kept
+    '''
+    def __init__(self, workers=8, max_queued=1000, default_quota=None, tenant_quotas=None,
+                 result_ttl=3600, max_finished=10000):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.default_quota = default_quota
+        self.tenant_quotas = tenant_quotas or {}
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.finished = OrderedDict()  # job id -> finish time, oldest first
+        self.queue = []  # heap of (-priority, seq, job)
+        self.queued = 0
+        self.running = {}  # tenant -> running jobs
+        self.sequence = itertools.count()
+        self.condition = None
+        self.worker_tasks = []
+
+    def _start(self):
+        # the workers are created in the running event loop, on the first submit
+        if not self.worker_tasks:
+            self.condition = asyncio.Condition()
+            self.worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    def quota(self, tenant):
+        return self.tenant_quotas.get(tenant, self.default_quota)
+
+    def submit(self, func, tenant="default", priority=0):
+        '''
+        func: coroutine function without arguments - the job
+        raises QueueFullError when the queue is full
+        '''
+        self._start()
+        self._prune()
+        if self.queued >= self.max_queued:
+            raise QueueFullError(f"job queue is full ({self.max_queued} jobs waiting)")
+        job = Job(func, tenant, priority)
+        self.jobs[job.job_id] = job
+        heapq.heappush(self.queue, (-priority, next(self.sequence), job))
+        self.queued += 1
+        asyncio.ensure_future(self._notify())
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        '''
+        cancel a waiting or running job, returns False if the job is unknown or already finished
+        '''
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return False
+        if job.status == "queued":
+            # removed from the heap lazily by the workers
+            self.queued -= 1
+            self._finish(job, "cancelled")
+        elif job.task is not None:
+            job.task.cancel()
+        return True
+
+    async def _notify(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def _next_job(self):
+        '''
+        pop the highest priority job whose tenant is below its quota, None if there is none
+        '''
+        skipped = []
+        job = None
+        while self.queue:
+            item = heapq.heappop(self.queue)
+            candidate = item[2]
+            if candidate.status != "queued":
+                continue
+            quota = self.quota(candidate.tenant)
+            if quota is not None and self.running.get(candidate.tenant, 0) >= quota:
+                skipped.append(item)
+                continue
+            job = candidate
+            break
+        for item in skipped:
+            heapq.heappush(self.queue, item)
+        return job
+
+    async def _worker(self):
+        while True:
+            async with self.condition:
+                job = self._next_job()
+                while job is None:
+                    await self.condition.wait()
+                    job = self._next_job()
+            self.queued -= 1
+            self.running[job.tenant] = self.running.get(job.tenant, 0) + 1
+            job.status = "running"
+            job.started = time.time()
+            job.task = asyncio.ensure_future(job.func())
+            try:
+                job.result = await job.task
+                self._finish(job, "completed")
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    # the worker itself is being stopped
+                    job.task.cancel()
+                    self._finish(job, "cancelled")
+                    raise
+                self._finish(job, "cancelled")
+            except Exception as e:
+                job.error = getattr(e, "detail", None) or str(e)
+                self._finish(job, "failed")
+            finally:
+                self.running[job.tenant] -= 1
+                job.task = None
+                # a quota slot is free - waiting jobs of this tenant may run now
+                await self._notify()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        job.func = None
+        self.finished[job.job_id] = job.finished
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        while self.finished:
+            job_id, finished = next(iter(self.finished.items()))
+            if finished >= cutoff and len(self.finished) <= self.max_finished:
+                break
+            self.finished.popitem(last=False)
+            self.jobs.pop(job_id, None)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "running": sum(self.running.values()),
+            "running_per_tenant": {tenant: count for tenant, count in self.running.items() if count},
+            "jobs": len(self.jobs),
+        }
@@ -0,0 +1,178 @@
+'''
+micro-batching scheduler for the llm interact functions
+
+when many sessions reach the same node at once, every step makes its own request.
+the batcher wraps an interact function (like LLMCache) and:
+- gathers the requests for the same model within a short window (window seconds, up to max_batch)
+- sends identical requests of a batch (same model, messages and options) as a single call
+  (the usage, retries and rate limits of the call are recorded on the span of every caller)
+- dispatches the batch through a bounded pool - at most `concurrency` calls per model in flight
+
+retries and rate limit pauses are left to llm_clients (llm/clients.py), which every interact function goes through,
+so a 429 pauses the model once, for every caller.
+
+the chat completions api has no synchronous batch endpoint,
+so a batch is dispatched as concurrent calls within the per-model limit.
+
+usage:
+    batcher = LLMBatcher(window=0.005, concurrency=8, model_concurrency={"gpt-4o": 4})
+    agentsFactory.createAgent(
+        name, batcher.wrap(interact_with_agent), role,
+        ainteract_func=batcher.awrap(ainteract_with_agent))
+
+wrap the batcher with the response cache (cache outside), so cache hits are not queued.
+the sync wrapper has no window - it only limits the concurrency.
+'''
+import asyncio
+import json
+import threading
+
+from buildingBlocks.tracing import tracer
+
+
+class _ModelState:
+    '''
+    per-model queue and limits
+    '''
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.pending = []  # (request key, future, call) waiting for the window to close
+        self.flush_handle = None
+        self.semaphore = None  # asyncio.Semaphore, created in the event loop
+        self.thread_semaphore = threading.BoundedSemaphore(concurrency)
+        self.in_flight = 0
+        self.requests = 0
+        self.calls = 0
+        self.batches = 0
+
+
+class LLMBatcher:
+    '''
+    window: float - seconds to gather requests for the same model before dispatching them
+    max_batch: int - dispatch right away once this many requests are waiting
+    concurrency: int - max calls in flight per model
+    model_concurrency: dict - model -> max calls in flight (overrides concurrency)
+    '''
+    def __init__(self, window=0.005, max_batch=32, concurrency=8, model_concurrency=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def _state(self, model):
+        state = self.models.get(model)
+        if state is None:
+            with self.lock:
+                state = self.models.get(model)
+                if state is None:
+                    state = _ModelState(self.model_concurrency.get(model, self.concurrency))
+                    self.models[model] = state
+        return state
+
+    # sync
+
+    def wrap(self, interact_func):
+        def batched_interact(llm_client, messages, model, **kwargs):
+            state = self._state(model)
+            state.requests += 1
+            with state.thread_semaphore:
+                state.in_flight += 1
+                state.calls += 1
+                try:
+                    return interact_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+                finally:
+                    state.in_flight -= 1
+        return batched_interact
+
+    # async
+
+    def awrap(self, ainteract_func):
+        async def batched_ainteract(llm_client, messages, model, **kwargs):
+            state = self._state(model)
+            state.requests += 1
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            call = lambda: ainteract_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+            # streaming requests have their own token callback - never shared
+            key = None if kwargs.get("on_token") is not None else self._request_key(llm_client, messages, model, kwargs)
+            state.pending.append((key, future, call))
+            if len(state.pending) >= self.max_batch:
+                self._flush(model)
+            elif state.flush_handle is None:
+                state.flush_handle = loop.call_later(self.window, self._flush, model)
+            result, error, attributes = await future
+            # the call ran in the context of the caller that flushed the batch
+            tracer.record(**attributes)
+            if error is not None:
+                raise error
+            return result
+        return batched_ainteract
+
+    @staticmethod
+    def _request_key(llm_client, messages, model, kwargs):
+        try:
+            return id(llm_client), model, json.dumps(messages, sort_keys=True), json.dumps(kwargs, sort_keys=True)
+        except TypeError:
+            return None
+
+    def _flush(self, model):
+        state = self.models[model]
+        if state.flush_handle is not None:
+            state.flush_handle.cancel()
+            state.flush_handle = None
+        batch, state.pending = state.pending, []
+        if not batch:
+            return
+        state.batches += 1
+        groups = {}
+        for key, future, call in batch:
+            if key is None:
+                asyncio.ensure_future(self._dispatch(state, call, [future]))
+            elif key in groups:
+                groups[key][1].append(future)
+            else:
+                groups[key] = (call, [future])
+        for call, futures in groups.values():
+            asyncio.ensure_future(self._dispatch(state, call, futures))
+
+    async def _dispatch(self, state, call, futures):
+        if state.semaphore is None:
+            state.semaphore = asyncio.Semaphore(state.concurrency)
+        # the attributes recorded by the call go to every caller (see batched_ainteract)
+        with tracer.capture() as attributes:
+            result, error = await self._call(state, call, futures)
+        for future in futures:
+            if not future.done():
+                future.set_result((result, error, attributes))
+
+    async def _call(self, state, call, futures):
+        '''
+        returns (result, error)
+        '''
+        if all(future.done() for future in futures):
+            # every caller was cancelled
+            return None, None
+        async with state.semaphore:
+            state.in_flight += 1
+            state.calls += 1
+            try:
+                return await call(), None
+            except Exception as e:
+                return None, e
+            finally:
+                state.in_flight -= 1
+
+    def stats(self):
+        return {
+            model: {
+                "concurrency": state.concurrency,
+                "in_flight": state.in_flight,
+                "queued": len(state.pending),
+                "requests": state.requests,
+                "calls": state.calls,
+                "batches": state.batches,
+            }
+            for model, state in self.models.items()
+        }
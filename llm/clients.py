@@ -0,0 +1,290 @@
+'''
+shared llm clients
+
+every llm call goes through llm_clients:
+- one OpenAI / AsyncOpenAI client per process, on a keep-alive connection pool
+  (max_connections, max_keepalive_connections, keepalive_expiry) with connect / request timeouts
+- per-model token buckets for requests per minute and tokens per minute
+  (the token estimate of a request is corrected with the usage the provider reports)
+- retries with exponential backoff and full jitter on rate limits, timeouts, connection and server errors.
+  a rate limit pauses the whole model for the retry-after time, so concurrent callers don't retry into it
+
+retries and waits are recorded on the current span (see buildingBlocks/tracing.py).
+
+usage:
+    llm_clients.configure(max_connections=200, model_limits={"gpt-4o": {"requests_per_minute": 500}})
+    client = llm_clients.client()
+    response = llm_clients.create(client, "gpt-4o-mini", messages)
+'''
+import asyncio
+import random
+import threading
+import time
+
+from buildingBlocks.tracing import tracer
+
+
+RETRY_STATUS_CODES = (408, 409, 429)
+RETRY_ERRORS = ("APIConnectionError", "APITimeoutError", "InternalServerError", "RateLimitError")
+
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRY_STATUS_CODES or status_code >= 500
+    return type(error).__name__ in RETRY_ERRORS
+
+
+def retry_after(error):
+    '''
+    seconds from the retry-after header of an error, None if missing
+    '''
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_request_tokens(messages, max_tokens=None):
+    '''
+    rough token count of a request (chars / 4), corrected later with the reported usage
+    '''
+    characters = sum(len(str(message.get("content") or "")) for message in messages)
+    return characters // 4 + len(messages) * 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    '''
+    rate: units per minute, the bucket holds at most one minute worth of units
+    reserve takes the units right away (the level can go negative) and returns how long to wait
+    '''
+    def __init__(self, rate):
+        self.rate = rate
+        self.level = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level * 60.0 / self.rate
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.level = min(self.rate, self.level + amount)
+
+
+class ModelLimits:
+    '''
+    requests_per_minute / tokens_per_minute: int (None - unlimited)
+    '''
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        '''
+        returns the seconds to wait before sending a request of ~tokens tokens
+        '''
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+        return wait
+
+    def settle(self, estimated, usage):
+        '''
+        correct the token bucket with the tokens the provider reported
+        '''
+        if self.tokens is None or usage is None:
+            return
+        actual = getattr(usage, "total_tokens", None)
+        if actual is None:
+            return
+        with self.lock:
+            self.tokens.refund(estimated - actual, time.monotonic())
+
+    def pause(self, delay):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+class LLMClients:
+    '''
+    max_connections / max_keepalive_connections / keepalive_expiry: connection pool of the http client
+    timeout / connect_timeout: seconds per request / per connection attempt
+    max_retries, base_delay, max_delay: retries with exponential backoff and full jitter
+    default_limits: dict - ModelLimits arguments for every model
+    model_limits: dict - model -> ModelLimits arguments (overrides default_limits)
+    '''
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0,
+                 timeout=60.0, connect_timeout=5.0, max_retries=3, base_delay=0.5, max_delay=20.0,
+                 default_limits=None, model_limits=None):
+        self.lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self.models = {}
+        self.configure(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                       keepalive_expiry=keepalive_expiry, timeout=timeout, connect_timeout=connect_timeout,
+                       max_retries=max_retries, base_delay=base_delay, max_delay=max_delay,
+                       default_limits=default_limits, model_limits=model_limits)
+
+    def configure(self, **settings):
+        '''
+        change the settings (the pool settings apply to clients created afterwards)
+        '''
+        with self.lock:
+            for name, value in settings.items():
+                setattr(self, name, value)
+            if "default_limits" in settings or "model_limits" in settings:
+                self.default_limits = self.default_limits or {}
+                self.model_limits = self.model_limits or {}
+                self.models = {}
+
+    def _http_settings(self):
+        import httpx
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        return limits, httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def client(self):
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+                    limits, timeout = self._http_settings()
+                    # retries are done here, with the model's limits in mind
+                    self._client = OpenAI(http_client=httpx.Client(limits=limits, timeout=timeout), timeout=timeout, max_retries=0)
+        return self._client
+
+    def async_client(self):
+        if self._async_client is None:
+            with self.lock:
+                if self._async_client is None:
+                    import httpx
+                    from openai import AsyncOpenAI
+                    limits, timeout = self._http_settings()
+                    self._async_client = AsyncOpenAI(http_client=httpx.AsyncClient(limits=limits, timeout=timeout), timeout=timeout, max_retries=0)
+        return self._async_client
+
+    def limits(self, model):
+        limits = self.models.get(model)
+        if limits is None:
+            with self.lock:
+                limits = self.models.get(model)
+                if limits is None:
+                    limits = ModelLimits(**self.model_limits.get(model, self.default_limits))
+                    self.models[model] = limits
+        return limits
+
+    def _backoff(self, limits, error, attempt):
+        '''
+        returns the delay before the next attempt, None if the error is final
+        '''
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if is_rate_limited(error):
+            limits.pause(delay)
+            tracer.record(rate_limited=True)
+        return delay
+
+    def create(self, llm_client, model, messages, **request):
+        '''
+        chat.completions.create within the model's limits, with retries
+        '''
+        limits = self.limits(model)
+        estimated = estimate_request_tokens(messages, request.get("max_tokens"))
+        waited = 0.0
+        attempt = 0
+        while True:
+            wait = limits.reserve(estimated)
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+            try:
+                response = llm_client.chat.completions.create(model=model, messages=messages, **request)
+                break
+            except Exception as e:
+                delay = self._backoff(limits, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                waited += delay
+                attempt += 1
+        tracer.record(retries=attempt, rate_limit_wait=waited)
+        if not request.get("stream"):
+            limits.settle(estimated, response.usage)
+        return response
+
+    async def acreate(self, llm_client, model, messages, **request):
+        '''
+        async version of create (for a stream, settle the usage with limits(model).settle)
+        '''
+        limits = self.limits(model)
+        estimated = estimate_request_tokens(messages, request.get("max_tokens"))
+        waited = 0.0
+        attempt = 0
+        while True:
+            wait = limits.reserve(estimated)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                waited += wait
+            try:
+                response = await llm_client.chat.completions.create(model=model, messages=messages, **request)
+                break
+            except Exception as e:
+                delay = self._backoff(limits, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                waited += delay
+                attempt += 1
+        tracer.record(retries=attempt, rate_limit_wait=waited)
+        if not request.get("stream"):
+            limits.settle(estimated, response.usage)
+        return response
+
+    def stats(self):
+        return {
+            "pool": {
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry,
+                "timeout": self.timeout,
+            },
+            "models": {
+                model: {
+                    "requests_available": limits.requests.level if limits.requests else None,
+                    "tokens_available": limits.tokens.level if limits.tokens else None,
+                    "paused_for": max(0.0, limits.paused_until - time.monotonic()),
+                }
+                for model, limits in self.models.items()
+            },
+        }
+
+
+# the process-wide clients
+llm_clients = LLMClients()
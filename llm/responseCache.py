@@ -0,0 +1,231 @@
+'''
+response cache for the llm interact functions
+
+the cache wraps an interact function (sync or async) and keeps its signature,
+so it plugs in where AgentsFactory.createAgent takes interact_func / ainteract_func.
+the key is a hash of the model and the messages.
+
+usage:
+    llm_cache = LLMCache(LRUCacheBackend(max_size=1024, ttl=3600))
+    agentsFactory.createAgent(
+        name, llm_cache.wrap(interact_with_agent), role,
+        ainteract_func=llm_cache.awrap(ainteract_with_agent))
+
+a step can opt out with "cache": false in its spec
+(the handler then calls the interact function with use_cache=False)
+'''
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from buildingBlocks.tracing import tracer
+
+
+def cache_key(model, messages):
+    '''
+    canonical hash of a request - same model and messages give the same key
+    '''
+    payload = json.dumps(
+        {"model": model, "messages": messages},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCacheBackend:
+    '''
+    in-memory cache
+    max_size: int - max number of entries, the least recently used are evicted
+    ttl: float - seconds an entry is valid (None - no expiry)
+    '''
+    blocking = False
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    '''
+    on-disk cache (sqlite, WAL mode) - survives restarts and is shared between worker processes
+    path: str - the database file
+    max_size: int - max number of entries, the least recently used are evicted
+    ttl: float - seconds an entry is valid (None - no expiry)
+    values are stored as json
+    expired and least recently used entries are evicted every max_size / 100 inserts (not on every insert),
+    and the access time of an entry is rewritten at most once per ACCESS_RESOLUTION seconds
+    '''
+    blocking = True  # LLMCache.awrap calls it in a worker thread
+    ACCESS_RESOLUTION = 60.0
+
+    def __init__(self, path="llm_cache.sqlite", max_size=100000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evict_every = max(1, max_size // 100)
+        self.inserts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at, accessed_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at < now:
+                self.connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            if now - accessed_at > self.ACCESS_RESOLUTION:
+                self.connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now)
+            )
+            self.inserts += 1
+            if self.inserts % self.evict_every == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        '''
+        drop expired entries and the least recently used ones above max_size
+        '''
+        self.connection.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        count = self.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_size:
+            self.connection.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_size,)
+            )
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM llm_cache")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class LLMCache:
+    '''
+    caching layer around interact functions
+    backend: LRUCacheBackend / SQLiteCacheBackend (anything with get/set/__len__ and blocking -
+             True if get / set do I/O, the async wrapper then calls them in a worker thread)
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, model, messages):
+        key = cache_key(model, messages)
+        return key, self._count(self.backend.get(key))
+
+    async def alookup(self, model, messages):
+        key = cache_key(model, messages)
+        if self.backend.blocking:
+            return key, self._count(await asyncio.to_thread(self.backend.get, key))
+        return key, self._count(self.backend.get(key))
+
+    async def _aset(self, key, response):
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.set, key, response)
+        else:
+            self.backend.set(key, response)
+
+    def _count(self, value):
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        tracer.record(cache_hit=value is not None)
+        return value
+
+    def wrap(self, interact_func):
+        def cached_interact(llm_client, messages, model, use_cache=True, **kwargs):
+            if not use_cache:
+                return interact_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+            key, response = self.lookup(model, messages)
+            if response is None:
+                response = interact_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+                if response is not None:
+                    self.backend.set(key, response)
+            return response
+        return cached_interact
+
+    def awrap(self, ainteract_func):
+        async def cached_ainteract(llm_client, messages, model, use_cache=True, **kwargs):
+            if not use_cache:
+                return await ainteract_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+            key, response = await self.alookup(model, messages)
+            if response is None:
+                response = await ainteract_func(llm_client=llm_client, messages=messages, model=model, **kwargs)
+                if response is not None:
+                    await self._aset(key, response)
+            elif kwargs.get("on_token") is not None:
+                # streaming caller - a cached response arrives as a single token
+                kwargs["on_token"](response)
+            return response
+        return cached_ainteract
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.backend),
+        }
@@ -0,0 +1,187 @@
+'''
+persistent session memory
+
+SQLiteMemoryStore keeps the memory of every session in a sqlite file (WAL mode),
+so sessions survive restarts and can be served by several worker processes.
+the conversation history is stored as one row per message (appended / dropped as the
+conversation goes), the other memory keys as one row per key - a turn only writes what changed.
+every save bumps the session's version, so a worker notices that its cached copy is stale.
+a save is only written on top of the version its changes were based on (VersionConflictError otherwise),
+so two workers can't overwrite each other's turns.
+'''
+import json
+import sqlite3
+import threading
+
+
+def _session_key(session_id):
+    if isinstance(session_id, (tuple, list)):
+        return "/".join(str(part) for part in session_id)
+    return str(session_id)
+
+
+def serialize(value):
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+class VersionConflictError(Exception):
+    '''
+    the session was saved by someone else since the expected version was loaded
+    '''
+    def __init__(self, session_id, expected, current):
+        super().__init__(f"session {session_id} is at version {current}, expected {expected}")
+        self.expected = expected
+        self.current = current
+
+
+class SQLiteMemoryStore:
+    def __init__(self, path="memory.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=5000")
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "session_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (session_id, key));"
+            "CREATE TABLE IF NOT EXISTS history ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (session_id, seq));"
+        )
+
+    def version(self, session_id):
+        '''
+        0 if the session was never saved
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version FROM sessions WHERE session_id = ?", (_session_key(session_id),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def load(self, session_id):
+        '''
+        returns (memory, snapshot, version)
+        memory: dict or None if the session was never saved
+        snapshot: key -> serialized value, to find the changed keys on the next save
+        '''
+        key = _session_key(session_id)
+        with self.lock:
+            row = self.connection.execute("SELECT version FROM sessions WHERE session_id = ?", (key,)).fetchone()
+            if row is None:
+                return None, {}, 0
+            rows = self.connection.execute("SELECT key, value FROM memory WHERE session_id = ?", (key,)).fetchall()
+            messages = self.connection.execute(
+                "SELECT message FROM history WHERE session_id = ? ORDER BY seq", (key,)
+            ).fetchall()
+        snapshot = dict(rows)
+        memory = {memory_key: json.loads(value) for memory_key, value in rows}
+        memory['conversation_history'] = [json.loads(message) for (message,) in messages]
+        return memory, snapshot, row[0]
+
+    def save(self, session_id, expected_version, changed, removed, appended, dropped):
+        '''
+        expected_version: the version the changes are based on (0 - a new session),
+                          raises VersionConflictError if the stored session is at another version
+        changed: key -> serialized value
+        removed: keys deleted from the memory
+        appended: messages added to the conversation history
+        dropped: number of messages dropped from the start of the history
+                 (None - the whole history is replaced by appended)
+        returns the new version of the session
+        '''
+        key = _session_key(session_id)
+        with self.lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT version FROM sessions WHERE session_id = ?", (key,)).fetchone()
+                current = row[0] if row else 0
+                if current != expected_version:
+                    raise VersionConflictError(session_id, expected_version, current)
+                if dropped is None:
+                    connection.execute("DELETE FROM history WHERE session_id = ?", (key,))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO memory (session_id, key, value) VALUES (?, ?, ?)",
+                    [(key, memory_key, value) for memory_key, value in changed.items()]
+                )
+                connection.executemany(
+                    "DELETE FROM memory WHERE session_id = ? AND key = ?",
+                    [(key, memory_key) for memory_key in removed]
+                )
+                if appended:
+                    last_seq = connection.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM history WHERE session_id = ?", (key,)
+                    ).fetchone()[0]
+                    connection.executemany(
+                        "INSERT INTO history (session_id, seq, message) VALUES (?, ?, ?)",
+                        [(key, last_seq + index, serialize(message)) for index, message in enumerate(appended, start=1)]
+                    )
+                if dropped is not None and dropped > 0:
+                    connection.execute(
+                        "DELETE FROM history WHERE session_id = ? AND seq IN "
+                        "(SELECT seq FROM history WHERE session_id = ? ORDER BY seq LIMIT ?)",
+                        (key, key, dropped)
+                    )
+                version = current + 1
+                connection.execute(
+                    "INSERT INTO sessions (session_id, version) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET version = excluded.version WHERE version = ?",
+                    (key, version, current)
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return version
+
+    def delete(self, session_id):
+        key = _session_key(session_id)
+        with self.lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("sessions", "memory", "history"):
+                    connection.execute(f"DELETE FROM {table} WHERE session_id = ?", (key,))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+
+def memory_delta(memory, snapshot):
+    '''
+    compare the memory (without the conversation history) to the last saved snapshot
+    returns (changed, removed) - apply them to the snapshot once they are saved (apply_memory_delta)
+    '''
+    changed = {}
+    for key, value in memory.items():
+        if key == 'conversation_history':
+            continue
+        serialized = serialize(value)
+        if snapshot.get(key) != serialized:
+            changed[key] = serialized
+    removed = [key for key in snapshot if key not in memory]
+    return changed, removed
+
+
+def apply_memory_delta(snapshot, changed, removed):
+    snapshot.update(changed)
+    for key in removed:
+        snapshot.pop(key, None)
+
+
+def merge_memory(memory, changed, removed, appended, dropped):
+    '''
+    the stored memory (None if there is none) with a save's changes applied on top, the way save writes them
+    '''
+    merged = dict(memory) if memory is not None else {'conversation_history': []}
+    for key, value in changed.items():
+        merged[key] = json.loads(value)
+    for key in removed:
+        merged.pop(key, None)
+    history = [] if dropped is None else list(merged['conversation_history'])
+    history.extend(appended)
+    merged['conversation_history'] = history[dropped or 0:]
+    return merged
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from conversationManger import ConversationManager
+from memoryStore import memory_delta, apply_memory_delta, merge_memory, VersionConflictError
+
+
+class Session:
+    def __init__(self, conversation_manager):
+        self.conversation_manager = conversation_manager
+        self.lock = asyncio.Lock()
+        self.last_access = time.monotonic()
+        # persistent memory: version of the stored memory this copy is based on (None - not loaded yet)
+        # and the serialized values that were last saved
+        self.version = None
+        self.snapshot = {}
+
+
+class SessionStore:
+    '''
+    keeps a ConversationManager per conversation id
+    flow_graph: FlowGraph - the default workflow for new sessions
+                (can also be given per session, see session)
+    max_sessions: int - above this the least recently used sessions are evicted
+    ttl: float - seconds, sessions idle for longer are evicted
+    max_memory: int - approx. size (in characters) of the conversation histories of all sessions together
+    save_attempts: int - saves of a turn when another worker saved the same session in between
+                   (the turn is applied on top of the other worker's version and saved again)
+    memory_store: SQLiteMemoryStore (optional) - persist the memory of the sessions,
+                  a session is loaded on first access and after another process changed it,
+                  every run writes only what changed
+    ** a session that is currently running is never evicted **
+    '''
+    def __init__(self, flow_graph=None, max_sessions=10000, ttl=3600, max_memory=256 * 1024 * 1024, memory_store=None,
+                 save_attempts=3):
+        self.flow_graph = flow_graph
+        self.memory_store = memory_store
+        self.save_attempts = save_attempts
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.sessions = OrderedDict()  # least recently used first
+        self.memory_size = 0
+
+    def get_or_create(self, session_id, flow_graph=None, history_window=None):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = Session(ConversationManager(flow_graph or self.flow_graph, id=session_id, history_window=history_window))
+            self.sessions[session_id] = session
+            self.memory_size += session.conversation_manager.size
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_access = time.monotonic()
+        return session
+
+    @asynccontextmanager
+    async def session(self, session_id, flow_graph=None, history_window=None):
+        '''
+        usage:
+        async with session_store.session(session_id) as conversation_manager:
+            response, run_time = await conversation_manager.arun(user_input)
+        runs of the same session are serialized, different sessions run concurrently
+        flow_graph: the workflow of the session if it has to be created (default - the store's flow_graph)
+        history_window: HistoryWindow of the session if it has to be created (optional)
+        '''
+        session = self.get_or_create(session_id, flow_graph, history_window)
+        async with session.lock:
+            size_before = session.conversation_manager.size
+            try:
+                if self.memory_store is not None:
+                    await self._load(session_id, session)
+                yield session.conversation_manager
+            finally:
+                if self.memory_store is not None:
+                    await self._save(session_id, session)
+                if self.sessions.get(session_id) is session:
+                    self.memory_size += session.conversation_manager.size - size_before
+                session.last_access = time.monotonic()
+                self.evict()
+
+    async def _load(self, session_id, session):
+        version = await asyncio.to_thread(self.memory_store.version, session_id)
+        if version == session.version:
+            return
+        memory, snapshot, version = await asyncio.to_thread(self.memory_store.load, session_id)
+        if memory is not None:
+            session.conversation_manager.replace_memory(memory)
+        session.snapshot = snapshot
+        session.version = version
+
+    async def _save(self, session_id, session):
+        conversation_manager = session.conversation_manager
+        changed, removed = memory_delta(conversation_manager.memory, session.snapshot)
+        appended, dropped = conversation_manager.history_delta()
+        if not (changed or removed or appended or dropped != 0):
+            return
+        for attempt in range(self.save_attempts):
+            try:
+                version = await asyncio.to_thread(
+                    self.memory_store.save, session_id, session.version or 0, changed, removed, appended, dropped)
+            except VersionConflictError:
+                # another worker saved the session since it was loaded - apply this turn on top of its version
+                session.version = None  # reloaded on the next run if this save fails for good
+                if attempt == self.save_attempts - 1:
+                    raise
+                memory, snapshot, version = await asyncio.to_thread(self.memory_store.load, session_id)
+                conversation_manager.replace_memory(merge_memory(memory, changed, removed, appended, dropped))
+                # the merged history is the stored one plus this turn's delta, which is still to be saved
+                conversation_manager.history_appended, conversation_manager.history_dropped = list(appended), dropped
+                session.snapshot = snapshot
+                session.version = version
+                continue
+            # only after the write - a failed save is written again with the next one
+            session.version = version
+            apply_memory_delta(session.snapshot, changed, removed)
+            conversation_manager.history_saved()
+            return
+
+    def remove(self, session_id):
+        '''
+        drop the session from memory (it stays in the memory store, see delete)
+        '''
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self.memory_size -= session.conversation_manager.size
+        return session is not None
+
+    async def delete(self, session_id):
+        '''
+        drop the session from memory and from the memory store
+        waits for a running turn of the session to finish (and save)
+        '''
+        removed = False
+        session = self.sessions.get(session_id)
+        if session is not None:
+            async with session.lock:
+                if self.sessions.get(session_id) is session:
+                    removed = self.remove(session_id)
+        if self.memory_store is not None and await asyncio.to_thread(self.memory_store.version, session_id):
+            await asyncio.to_thread(self.memory_store.delete, session_id)
+            removed = True
+        return removed
+
+    def evict(self):
+        '''
+        drop idle sessions (ttl) and then the least recently used ones
+        until the store is back under max_sessions and max_memory
+        '''
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_access <= self.ttl:
+                break
+            if not session.lock.locked():
+                self.remove(session_id)
+
+        for session_id, session in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and self.memory_size <= self.max_memory:
+                break
+            if not session.lock.locked():
+                self.remove(session_id)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -1,18 +1,94 @@
 import asyncio
+import uuid
 import websockets
 import json
 
-async def connection_handler(websocket, path):
+import api
+
+'''
+streaming run endpoint over websocket
+every message is a JSON object:
+    {"type": "build", "workflow": {...}} - build the workflow (same schema as POST /build)
+    {"type": "run", "user_input": "...", "session_id": "...", "workflow_id": "..."} - run it,
+        session_id and workflow_id are optional (default workflow is the last built one)
+the server answers with JSON events:
+    build -> {"event": "built", "workflow_id": ...} / {"event": "error", "detail": ...}
+    run -> node_start / token / node_end events and a final end (or error) event,
+           see ConversationManager.astream
+    a malformed message or a failed run -> {"event": "error", "detail": ...}, the connection stays open
+'''
+
+# required fields and their types per message type
+REQUIRED_FIELDS = {
+    "build": {"workflow": dict},
+    "run": {"user_input": str},
+}
+OPTIONAL_FIELDS = {
+    "run": {"session_id": str, "workflow_id": str},
+}
+
+async def send_event(websocket, event):
+    await websocket.send(json.dumps(event, default=str))
+
+def validate_message(data):
+    '''
+    returns an error message for a malformed message, None if it is valid
+    '''
+    if not isinstance(data, dict):
+        return "message must be a JSON object"
+    message_type = data.get("type")
+    if message_type not in REQUIRED_FIELDS:
+        return f"unknown message type: {message_type}"
+    for field, field_type in REQUIRED_FIELDS[message_type].items():
+        if field not in data:
+            return f"missing field: {field}"
+        if not isinstance(data[field], field_type):
+            return f"{field} must be of type {field_type.__name__}"
+    for field, field_type in OPTIONAL_FIELDS.get(message_type, {}).items():
+        if data.get(field) is not None and not isinstance(data[field], field_type):
+            return f"{field} must be of type {field_type.__name__}"
+    return None
+
+async def handle_message(websocket, data):
+    error = validate_message(data)
+    if error is not None:
+        await send_event(websocket, {"event": "error", "detail": error})
+        return
+    message_type = data["type"]
+    if message_type == "build":
+        try:
+            # compiling blocks - keep the event loop free for the other clients
+            result = await asyncio.to_thread(api.initialize_workflow, api.WorkflowSchema(**data["workflow"]))
+            await send_event(websocket, {"event": "built", "workflow_id": result["workflow_id"]})
+        except Exception as e:
+            await send_event(websocket, {"event": "error", "detail": str(getattr(e, "detail", e))})
+    else:
+        try:
+            compiled_workflow = api.get_workflow(data.get("workflow_id"))
+        except Exception as e:
+            await send_event(websocket, {"event": "error", "detail": str(getattr(e, "detail", e))})
+            return
+        session_id = data.get("session_id") or uuid.uuid4().hex
+        async for event in api.stream_run(compiled_workflow, session_id, data["user_input"]):
+            await send_event(websocket, event)
+
+async def connection_handler(websocket, path=None):
     print("Client connected!")
     try:
         async for message in websocket:
             # Parse the received JSON data
             try:
                 data = json.loads(message)
-                print("Received JSON data:", data)
-                # You can process the data here
             except json.JSONDecodeError:
-                print("Received invalid JSON data")
+                await send_event(websocket, {"event": "error", "detail": "invalid JSON"})
+                continue
+            try:
+                await handle_message(websocket, data)
+            except websockets.ConnectionClosed:
+                raise
+            except Exception as e:
+                # a failing message must not close the connection
+                await send_event(websocket, {"event": "error", "detail": str(getattr(e, "detail", e))})
     except websockets.ConnectionClosed:
         print("Client disconnected!")
 
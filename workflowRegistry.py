@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def workflow_hash(workflow_dict):
+    '''
+    canonical hash of a workflow schema - the same design always gets the same id
+    '''
+    payload = json.dumps(workflow_dict, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class CompiledWorkflow:
+    '''
+    everything built from one workflow schema: tools, agents, task plans and the flow graph
+    ** built once and never changed afterwards - rebuild (new id) to change a workflow **
+    optimization: the report of the build-time optimizer (see factories/workflowOptimizer.py)
+    '''
+    __slots__ = ("workflow_id", "agents_factory", "flow_graph", "history_window", "optimization")
+
+    def __init__(self, workflow_id, agents_factory, flow_graph, history_window=None, optimization=None):
+        self.workflow_id = workflow_id
+        self.agents_factory = agents_factory
+        self.flow_graph = flow_graph
+        self.history_window = history_window
+        self.optimization = optimization
+
+
+class WorkflowRegistry:
+    '''
+    bounded LRU cache of compiled workflows keyed by workflow id
+    max_workflows: int - above this the least recently used workflows are evicted
+    '''
+    def __init__(self, max_workflows=64):
+        self.max_workflows = max_workflows
+        self.workflows = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, workflow_id):
+        with self.lock:
+            compiled_workflow = self.workflows.get(workflow_id)
+            if compiled_workflow is not None:
+                self.workflows.move_to_end(workflow_id)
+            return compiled_workflow
+
+    def get_or_build(self, workflow_id, build_func):
+        '''
+        build_func: function() -> CompiledWorkflow, called only if the id is not cached
+        returns (compiled_workflow, built: bool)
+        '''
+        compiled_workflow = self.get(workflow_id)
+        if compiled_workflow is not None:
+            return compiled_workflow, False
+
+        # build outside the lock - concurrent builds of the same design give equal workflows
+        compiled_workflow = build_func()
+        with self.lock:
+            compiled_workflow = self.workflows.setdefault(workflow_id, compiled_workflow)
+            self.workflows.move_to_end(workflow_id)
+            while len(self.workflows) > self.max_workflows:
+                self.workflows.popitem(last=False)
+        return compiled_workflow, True
+
+    def __contains__(self, workflow_id):
+        return workflow_id in self.workflows
+
+    def __len__(self):
+        return len(self.workflows)